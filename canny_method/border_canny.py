@@ -1,19 +1,56 @@
 from .canny import *
+from .tiled import TiledImage
 
-def main(filename, reduction, r_params, max_dist, fuse_dist, bw_thresh):
-    new_img = Image(filename, 60, 150, bw_thresh)
+# Read image and trace paths, stages that don't depend on reduction parameters
+# If tile_size is set, the image is traced in tiles of tile_size pixels
+def trace(filename, bw_thresh, min_area=0, edge_mode="canny", tile_size=0, workers=1):
+    if tile_size > 0:
+        new_img = TiledImage(filename, 60, 150, bw_thresh, tile_size, min_area, edge_mode)
+    else:
+        new_img = Image(filename, 60, 150, bw_thresh, min_area, edge_mode)
 
+    new_img.set_workers(workers)
     new_img.make_edges()
 
+    return new_img
+
+# Run stages after tracing, new_img is modified
+def process(new_img, reduction, r_params, max_dist, fuse_dist, frag_params=(0,0), workers=1):
+    new_img.set_workers(workers)
+    new_img.remove_fragments(max_dist, fuse_dist, frag_params[0], frag_params[1])
+
     new_img.edge_reduce(reduction, r_params)
 
     new_img.fuse_ends(max_dist)
-    new_img.close_loops(max_dist)
-    new_img.keep_loops()
-    new_img.fuse_points(fuse_dist)
-    new_img.remove_small_polygons(fuse_dist)
+    new_img.post_process(max_dist, fuse_dist)
     new_img.final_processing()
 
     new_img.draw_edges()
 
     return [new_img.format_paths(), new_img.get_original()]
+
+def main(filename, reduction, r_params, max_dist, fuse_dist, bw_thresh, frag_params=(0,0), min_area=0, edge_mode="canny", workers=1, tile_size=0):
+    new_img = trace(filename, bw_thresh, min_area, edge_mode, tile_size, workers)
+
+    return process(new_img, reduction, r_params, max_dist, fuse_dist, frag_params, workers)
+
+# Run every parameter combination on a copy of the same traced image
+# Each combination is a list [reduction, r_params, max_dist, fuse_dist] or
+# [reduction, r_params, max_dist, fuse_dist, frag_params, workers]. If a cache dict is
+# given, traced images are kept in it by (filename, bw_thresh, min_area,
+# edge_mode) and reused by later calls
+def sweep(filename, combinations, bw_thresh, min_area=0, edge_mode="canny", cache=None):
+    key = (filename, bw_thresh, min_area, edge_mode)
+
+    if cache is not None and key in cache:
+        traced = cache[key]
+    else:
+        traced = trace(filename, bw_thresh, min_area, edge_mode)
+        if cache is not None:
+            cache[key] = traced
+
+    results = []
+    for params in combinations:
+        results.append(process(traced.copy(), *params))
+
+    return results
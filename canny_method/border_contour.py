@@ -0,0 +1,17 @@
+from .canny import *
+
+def main(filename, reduction, r_params, fuse_dist, bw_thresh, min_area=0, workers=1):
+    new_img = Image(filename, 60, 150, bw_thresh, min_area)
+    new_img.set_workers(workers)
+
+    new_img.make_contours()
+
+    new_img.edge_reduce(reduction, r_params)
+
+    new_img.fuse_points(fuse_dist)
+    new_img.remove_small_polygons(fuse_dist)
+    new_img.update_hole_points()
+
+    new_img.draw_edges()
+
+    return [new_img.format_paths(), new_img.get_original()]
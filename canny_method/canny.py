@@ -1,36 +1,211 @@
 import cv2
 import numpy as np
-import math
 import copy
+import heapq
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from geometry import *
 
-# Path class, associated with graph, stores edge list
+#####################
+# REDUCTION KERNELS #
+#####################
+
+# Get end vertex of the reduced edge starting at every vertex
+# An edge from s can end at c if every vertex between them is within max_dist
+# of the edge, and the first candidate c that fails ends the edge at c-1.
+# Candidates at the same offset from s are tested for all vertices in one pass.
+# Edges with no failing candidate end at bound, vertices without an end after
+# window offsets are set to -1
+def greedy_edge_ends(x, y, last, bound, max_dist, window):
+
+    ends = np.full(len(x), -1)
+
+    # Vertices with at least 2 edges left in their path
+    active = np.flatnonzero(np.arange(len(x))+1 < last)
+
+    j = 2
+    while len(active) > 0 and j <= window+1:
+        c = active + j
+
+        # No candidates left
+        done = c > bound[active]
+        ends[active[done]] = bound[active[done]]
+        active = active[~done]
+        c = c[~done]
+
+        # Check distance to all skipped vertices
+        k = active + np.arange(1, j)[:,None]
+        invalid = (line_point_dists(x, y, active, c, k) > max_dist).any(axis=0)
+
+        ends[active[invalid]] = c[invalid] - 1
+        active = active[~invalid]
+        j += 1
+
+    return ends
+
+# Get end vertex of the reduced edge starting at s, testing candidates from
+# first_c in blocks of increasing size
+def greedy_edge_end(x, y, s, bound, max_dist, first_c):
+
+    c_start = first_c
+    size = 32
+
+    while c_start <= bound:
+        c = np.arange(c_start, min(bound, c_start+size-1)+1)
+        k = np.arange(s+1, c[-1])[:,None]
+
+        # Only vertices before each candidate are checked
+        invalid = ((line_point_dists(x, y, s, c, k) > max_dist) & (k < c)).any(axis=0)
+
+        if invalid.any():
+            return int(c[np.argmax(invalid)]) - 1
+
+        c_start = c[-1] + 1
+        size *= 2
+
+    return bound
+
+# Greedy reduction for variable and hybrid methods
+# Each edge starts at the end of the previous one, and is extended while all
+# skipped vertices are within max_dist of it and, if reduction_limit is set,
+# while it skips less than reduction_limit vertices. Vertex arrays of all paths
+# are concatenated, so ends are found for every path at the same time
+def greedy_reduce(paths, max_dist, reduction_limit=None, window=32):
+
+    paths = [p for p in paths if p.get_edges_len() >= 2]
+    if len(paths) == 0:
+        return
+
+    points = np.concatenate([p.get_points() for p in paths]).astype(np.float64)
+    x = points[:,0]
+    y = points[:,1]
+
+    lens = [len(p.get_points()) for p in paths]
+    offsets = np.cumsum([0] + lens).tolist()
+
+    # Last vertex of the path containing each vertex
+    last = np.repeat(np.array(offsets[1:])-1, lens)
+
+    bound = last
+    if reduction_limit is not None:
+        bound = np.minimum(last, np.arange(len(x))+1+reduction_limit)
+
+    ends = greedy_edge_ends(x, y, last, bound, max_dist, window).tolist()
+    bound = bound.tolist()
+
+    for i in range(len(paths)):
+        first_v = offsets[i]
+        last_v = offsets[i+1]-1
+
+        kept = np.zeros(lens[i], dtype=bool)
+        kept[0] = True
+        kept[-1] = True
+
+        start_v = first_v
+        while start_v+1 < last_v:
+            end_v = ends[start_v]
+
+            # Long edges continue the search from the last tested candidate
+            if end_v < 0:
+                end_v = greedy_edge_end(x, y, start_v, bound[start_v], max_dist, start_v+window+2)
+
+            if end_v >= last_v:
+                break
+
+            kept[end_v-first_v] = True
+            start_v = end_v
+
+        paths[i].delete(~kept)
+
+
+####################
+# BOUNDARY KERNELS #
+####################
+
+# Neighbors of every pixel of mask, as views of the padded mask
+# Order is top, top-right, right, bottom-right, bottom, bottom-left, left,
+# top-left
+def neighbor_views(mask):
+    h, w = mask.shape
+    padded = np.zeros((h+2, w+2), dtype=bool)
+    padded[1:-1,1:-1] = mask
+
+    return [padded[:-2,1:-1], padded[:-2,2:], padded[1:-1,2:], padded[2:,2:],
+            padded[2:,1:-1], padded[2:,:-2], padded[1:-1,:-2], padded[:-2,:-2]]
+
+# Zhang-Suen thinning, removes pixels that don't change connectivity
+def thin_mask(mask):
+    mask = mask.copy()
+    changed = True
+
+    while changed:
+        changed = False
+        for step in range(2):
+            n = neighbor_views(mask)
+            t, tr, r, br, b, bl, l, tl = n
+
+            count = sum(v.astype(np.uint8) for v in n)
+            transitions = sum((~n[i] & n[(i+1)%8]).astype(np.uint8) for i in range(8))
+
+            if step == 0:
+                keep = (t & r & b) | (r & b & l)
+            else:
+                keep = (t & r & l) | (t & b & l)
+
+            deleted = mask & (count >= 2) & (count <= 6) & (transitions == 1) & ~keep
+
+            if deleted.any():
+                mask &= ~deleted
+                changed = True
+
+    return mask
+
+# One pixel outline of the black regions of a black-white image
+# Pixels with a white 4-neighbor form an 8-connected boundary, which is
+# thinned. Where regions or thin lines meet the outline has junctions,
+# make_paths splits the traced paths there as with canny edges
+def boundary_mask(bw):
+    black = (bw == 0).astype(np.uint8)
+    cross = cv2.getStructuringElement(cv2.MORPH_CROSS, (3,3))
+    mask = (black ^ cv2.erode(black, cross, borderValue=0)).astype(bool)
+
+    return thin_mask(mask)
+
+
+# Path class, associated with graph, stores vertex array
+# Vertices are stored once, as an int32 array of shape (n+1,2) for n edges,
+# where edge i goes from vertex i to vertex i+1. Closed paths repeat the
+# first vertex at the end
 class Path:
 
-    def __init__(self, graph):
+    def __init__(self, graph, points):
         self.graph = graph
-        self.edges = []
+        self.points = points
         self.containers = 0
         self.clockwise = True 
         self.hole_point = None
+        self.bounding_box = None
+        self.parent = None # Innermost containing path
+        self.children = [] # Paths with self as innermost container
 
     ###############
     #   GETTERS   #
     ###############
 
-    def get_edges(self):
-        return self.edges
-
-    def get_first(self):
-        return self.edges[0]
+    def get_points(self):
+        return self.points
     
-    def get_last(self):
-        return self.edges[-1]
+    # Get vertex at index i as tuple
+    def get_point(self, i):
+        return tuple(self.points[i].tolist())
     
-    def get_i(self, i):
-        return self.edges[i]
+    # Get edge list as [start, end] pairs, built from vertex array
+    def get_edges(self):
+        points = [tuple(p) for p in self.points.tolist()]
+        return [[points[i], points[i+1]] for i in range(len(points)-1)]
     
     def get_edges_len(self):
-        return len(self.edges)
+        return len(self.points) - 1
     
     def get_bounding_box(self):
         return self.bounding_box
@@ -41,50 +216,73 @@ class Path:
     def get_hole_point(self):
         return self.hole_point
     
+    def get_parent(self):
+        return self.parent
+    
+    def get_children(self):
+        return self.children
+    
     ###############
     #   SETTERS   #
     ###############
     
-    # Add edge at final position in edge list
-    def add(self, edge):
-        self.edges.append(edge)
-
-    # Add edge at initial position in edge list
-    def add_first(self, edge):
-        self.edges.insert(0, edge)
+    # Set vertex at index i
+    def set_point(self, i, point):
+        self.points[i] = point
     
-    # Delete edge at index i
-    def delete(self, i):
-        return self.edges.pop(i)
+    # Delete every vertex where mask is True
+    def delete(self, mask):
+        self.points = self.points[~mask]
     
-    # Concatenate two edge lists
+    # Concatenate two paths, last vertex of self must be first vertex of path
     def append(self, path):
-        self.edges += path.get_edges()
+        self.points = np.concatenate((self.points, path.get_points()[1:]))
     
     def add_container(self):
         self.containers += 1
+
+    # Set innermost containing path
+    def set_parent(self, path):
+        self.parent = path
+        path.children.append(self)
+
+    # Copy path into graph, parent and children are not copied
+    def copy(self, graph):
+        new_path = Path(graph, self.points.copy())
+        new_path.containers = self.containers
+        new_path.clockwise = self.clockwise
+        new_path.hole_point = self.hole_point
+        new_path.bounding_box = self.bounding_box
+        return new_path
     
     ################
     #   GEOMETRY   #
     ################
 
-    # Get highest point in path
+    # Update bounding box as (min_x, min_y, max_x, max_y)
+    def update_bounding_box(self):
+        min_x, min_y = self.points.min(axis=0).tolist()
+        max_x, max_y = self.points.max(axis=0).tolist()
+
+        self.bounding_box = (min_x, min_y, max_x, max_y)
+        return self.bounding_box
+
+    # Get index of first edge with highest start point in path
     def highest_point(self):
-        return min(self.get_edges(), key=lambda e: e[0][1])
+        return int(np.argmin(self.points[:-1,1]))
 
     # Get orientation of path. If < 0, counterclockwise, else clockwise
+    # Orientation is the turn at the highest vertex, which is always convex in
+    # simple polygons. Shoelace signed area gives the same result for simple
+    # polygons, but not for the self-intersecting ones made by fuse_points
     def orientation(self):
 
-        def get_cross(p1,p2,q1,q2):
-            a_0 = [p2[0]-p1[0],p2[1]-p1[1]]
-            b_0 = [q2[0]-q1[0],q2[1]-q1[1]]
-
-            return np.cross(a_0,b_0)
-        
-        edge_1 = self.highest_point()
+        i = self.highest_point()
+        j = (i-1)%self.get_edges_len()
 
-        i = self.get_edges().index(edge_1)
-        edge_2 = self.get_i(i-1)
+        # Highest edge and previous edge
+        edge_1 = (self.get_point(i), self.get_point(i+1))
+        edge_2 = (self.get_point(j), self.get_point(j+1))
 
         cross = get_cross(edge_1[0], edge_1[1], edge_2[1], edge_2[0])
 
@@ -98,27 +296,13 @@ class Path:
         else:
             return -cross//abs(cross)
     
-    # Swap orientation of path
+    # Swap orientation of path, as a reversed view of the vertex array
     def change_orientation(self):
-
-        new_edges = []
-
-        for e in self.get_edges():
-            new_edges.insert(0, [e[1],e[0]])
-
-        self.edges = new_edges
+        self.points = self.points[::-1]
 
     # Check containing polygons
     def container_check(self, path):
 
-        def get_intersection(v1, v2, y):
-            if v1[0] != v2[0]:
-                m = (v1[1]-v2[1])/(v1[0]-v2[0])
-                b = v1[1] - m*v1[0]
-                return (y-b)//m
-            else:
-                return v1[0]
-
         def point_in_polygon(point, path):
             y = point[1]
 
@@ -134,45 +318,15 @@ class Path:
             # If odd, point is in polygon
             return count%2==1
 
-        first_point = self.get_edges()[0][0]
+        first_point = self.get_point(0)
         if point_in_polygon(first_point, path):
             self.add_container()
     
     # If number of containers is odd, set hole to true
+    # Hole point is the centroid of the first convex vertex with angle up to 90
+    # and adjacent edges of similar length, or of the vertex closest to that
+    # before it. Angles and weights are computed for all vertices at once
     def update_hole_point(self):
-
-        def get_cross(p1,p2,q1,q2):
-            a_0 = [p2[0]-p1[0],p2[1]-p1[1]]
-            b_0 = [q2[0]-q1[0],q2[1]-q1[1]]
-
-            return np.cross(a_0,b_0)
-
-        def get_angle(p1,p2,q1,q2):
-            v1 = [(p2[0]-p1[0]),(p2[1]-p1[1])]
-            v2 = [(q2[0]-q1[0]),(q2[1]-q1[1])]
-
-            dot = v1[0]*v2[0] + v1[1]*v2[1]
-
-            mv1 = math.sqrt(v1[0]**2+v1[1]**2)
-            mv2 = math.sqrt(v2[0]**2+v2[1]**2)
-
-            a = dot/(mv1*mv2)
-            if a > 1:
-                a = 1
-            if a < -1:
-                a = -1
-
-            cross = get_cross(p1,p2,q1,q2)
-            
-            angle = int(math.degrees(math.acos(a)))
-
-            if cross < 0:
-                return 360 - angle
-            else:
-                return angle 
-            
-        def length(p1, p2):
-            return math.sqrt(((p2[0]-p1[0])**2)+((p2[1]-p1[1])**2))
         
         def centroid(p1, p2, p3):
             x = (p1[0] + p2[0] + p3[0])//3
@@ -188,51 +342,45 @@ class Path:
             if not clockwise:
                 self.change_orientation()
 
-            min_a_w = 21
-            min_i = 0
+            points = self.get_points()
+            n = len(points) - 1
 
-            for i in range(len(self.get_edges())):
-                a2, a1 = self.get_i(i)
-                b1, b2 = self.get_i((i+1)%len(self.get_edges()))
+            # Angle at vertex i+1 between edge i, reversed, and edge (i+1)%n
+            edges = np.diff(points, axis=0).astype(np.int64)
+            v1 = -edges
+            v2 = np.roll(edges, -1, axis=0)
 
-                angle = get_angle(a1,a2,b1,b2)
+            len1 = norms(edges)
+            len2 = np.roll(len1, -1)
 
-                if angle > 180:
-                    continue
+            # Repeated vertices have no angle
+            angle, valid = signed_vector_angles(v1, v2)
+            valid &= angle <= 180
 
-                len1 = length(a1,a2)
-                len2 = length(b1,b2)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                len_diff = np.minimum(len1,len2)/np.maximum(len1,len2)
 
-                len_diff = min(len1,len2)/max(len1,len2)
+            # Distance to 60, greater is worse
+            # Range from 0 to 10, 0 is best
+            angle_weight = np.minimum(np.abs(angle-60), 120)/6
 
-                # Distance to 60, greater is worse
-                # Range from 0 to 10, 0 is best
-                angle_weight = abs(angle-60)
-                if angle_weight > 120:
-                    angle_weight = 120
-                angle_weight = angle_weight/6
+            # Distance to 1, greater is worse
+            # Range from 0 to 10, 0 is best
+            len_weight = np.maximum(0.5-len_diff, 0)*20
 
-                # Distance to 1, greater is worse
-                # Range from 0 to 10, 0 is best
-                len_weight = 0.5-len_diff
-                if len_weight < 0:
-                    len_weight = 0
-                len_weight = len_weight*20
+            weight = angle_weight + len_weight
 
-                cond1 = angle <= 90
-                cond2 = len_diff > 0.5
+            # Search stops at first vertex with angle up to 90 and similar edges
+            found = np.flatnonzero(valid & (angle <= 90) & (len_diff > 0.5))
+            stop = found[0]+1 if len(found) > 0 else n
 
-                if angle_weight + len_weight < min_a_w:
-                    min_a_w = angle_weight + len_weight
-                    min_i = i
+            candidates = np.flatnonzero(valid[:stop] & (weight[:stop] < 21))
+            min_i = int(candidates[np.argmin(weight[candidates])]) if len(candidates) > 0 else 0
 
-                if cond1 and cond2:
-                    break
-
-            a, v = self.get_i(min_i)
-            _, b = self.get_i((min_i+1)%len(self.get_edges()))
+            a, v = points[min_i].tolist(), points[min_i+1].tolist()
+            b = points[(min_i+1)%n+1].tolist()
 
-            if self.get_edges()[0][0] == self.get_edges()[-1][1]:
+            if (points[0] == points[-1]).all():
                 self.hole_point = centroid(a,v,b)
                 
         else:
@@ -247,137 +395,62 @@ class Path:
     ###############
 
     # Constant length edge reduction method
+    # Every edge skips reduction_limit vertices, so kept vertices are a strided
+    # slice of the vertex array, plus the last vertex
     def edge_reduce_constant(self, reduction_limit):
 
-        # If reduction_limit is 0, return original array
-        if reduction_limit == 0:
-            return self.get_edges()
-
-        limit = reduction_limit # Counter for reductions
-        start_e = 0
+        n = self.get_edges_len()
 
-        # Go through every edge in path
-        while True:
+        # If reduction_limit is 0, return original array
+        if reduction_limit == 0 or n < 2:
+            return self.get_points()
 
-            self.get_i(start_e)[1] = self.delete(start_e+1)[1]
-            limit -= 1
+        deleted = np.ones(n+1, dtype=bool)
+        deleted[::reduction_limit+1] = False
+        deleted[n] = False
 
-            if limit <= 0:
-                start_e += 1
-                limit = reduction_limit
-            
-            if start_e >= self.get_edges_len()-1:
-                break
-        
-        return self.get_edges()
+        self.delete(deleted)
+        return self.get_points()
     
     # Variable length edge reduction method
     def edge_reduce_variable(self, max_dist):
-
-        #Auxiliary function
-        def line_point_dist(p1,p2,p):
-            x1, y1 = p1
-            x2, y2 = p2
-            x0, y0 = p
-
-            if (x1, y1) == (x2, y2):
-                return math.sqrt((x0 - x1)**2 + (y0 - y1)**2)
-
-            return abs((x2-x1)*(y1-y0) - (x1-x0)*(y2-y1))/math.sqrt(((x2-x1)**2)+((y2-y1)**2))
-        
-        start_e = 0
-        # Array of eliminated points for future comparison
-        near_points = [self.get_i(start_e)[1]]
-
-        # Go through every edge in path
-        while True:
-
-            if start_e+1 >= self.get_edges_len():
-                break
-
-            # New edge to be generated
-            new_e = (self.get_i(start_e)[0],self.get_i(start_e+1)[1])
-            valid = True
-
-            # Check distance to all previous points
-            for p in near_points:
-                dist = line_point_dist(new_e[0],new_e[1],p)
-                if dist > max_dist:
-                    valid = False
-        
-            # If new vector fulfills the conditions, reduce vector
-            if valid:
-                new_point = self.delete(start_e+1)
-                near_points.append(new_point[1])
-                self.get_i(start_e)[1] = new_point[1]
-
-            if start_e >= self.get_edges_len()-1:
-                break
-
-            # Else advance to next point
-            if not valid:
-                start_e += 1
-                near_points = [self.get_i(start_e)[1]]
-
-        return self.get_edges()
+        greedy_reduce([self], max_dist)
+        return self.get_points()
     
     # Hybrid edge reduction method
     def edge_reduce_threshold(self, reduction_limit, max_dist):
 
-        #Auxiliary function
-        def line_point_dist(p1,p2,p):
-            x1, y1 = p1
-            x2, y2 = p2
-            x0, y0 = p
-
-            if (x1, y1) == (x2, y2):
-                return math.sqrt((x0 - x1)**2 + (y0 - y1)**2)
-
-            return abs((x2-x1)*(y1-y0) - (x1-x0)*(y2-y1))/math.sqrt(((x2-x1)**2)+((y2-y1)**2))
-        
         # If reduction_limit is 0, return original array
         if reduction_limit == 0:
-            return self.get_paths()
-
-        limit = reduction_limit # Counter for reductions
-
-        start_e = 0
-        # Array of eliminated points for future comparison
-        near_points = [self.get_i(start_e)[1]]
-
-        # Go through every edge in path
-        while True:
+            return self.get_points()
 
-            if start_e+1 >= self.get_edges_len():
-                break
-
-            # New edge to be generated
-            new_e = (self.get_i(start_e)[0],self.get_i(start_e+1)[1])
-            valid = True
-
-            # Check distance to all previous points
-            for p in near_points:
-                dist = line_point_dist(new_e[0],new_e[1],p)
-                if dist > max_dist:
-                    valid = False
-        
-            # If new vector fulfills the conditions, reduce vector
-            if valid:
-                new_point = self.delete(start_e+1)
-                near_points.append(new_point[1])
-                self.get_i(start_e)[1] = new_point[1]
-                limit -= 1
-
-            if start_e >= self.get_edges_len()-1:
-                break
+        greedy_reduce([self], max_dist, reduction_limit)
+        return self.get_points()
+    
+    # Douglas-Peucker edge reduction method, max_dist is used as epsilon
+    # All paths keep both ends, closed paths are split at the vertex farthest
+    # from the first one. Loops are collapsed to their first vertex if less
+    # than 3 vertices would remain, same as the greedy methods do with loops
+    # smaller than max_dist
+    def edge_reduce_dp(self, max_dist):
+
+        points = self.get_points()
+        closed = len(points) > 3 and (points[0] == points[-1]).all()
+
+        if closed:
+            dist = ((points - points[0]).astype(np.float64)**2).sum(axis=1)
+            k = int(dist.argmax())
+            approx = np.concatenate((cv2.approxPolyDP(points[:k+1], max_dist, False),
+                                     cv2.approxPolyDP(points[k:], max_dist, False)[1:]))
+            if len(approx) < 4:
+                self.points = points[[0, -1]]
+                return self.get_points()
+        else:
+            approx = cv2.approxPolyDP(points, max_dist, False)
 
-            # Advance to next point
-            if not valid or limit <= 0:
-                start_e += 1
-                near_points = [self.get_i(start_e)[1]]
-                limit = reduction_limit
-        
-        return self.get_edges()
+        self.points = approx.reshape(-1, 2).astype(np.int32)
+        return self.get_points()
+    
     
     ###################
     # POST-PROCESSING #
@@ -386,64 +459,79 @@ class Path:
     # Make loops in paths with similar start and end points
     def close_loops(self, max_dist):
 
-        # Auxiliary function
-        def dist_two_points(p1,p2):
-            return math.sqrt((p2[0]-p1[0])**2 + (p2[1]-p1[1])**2)
-
-        first_point = self.get_i(0)[0]
-        last_point = self.get_i(-1)[1]
+        first_point = self.get_point(0)
+        last_point = self.get_point(-1)
 
-        dist = dist_two_points(first_point, last_point)
-
-        if dist <= max_dist:
+        if dist_at_most(first_point, last_point, max_dist):
             new_point = (((first_point[0]+last_point[0])//2),((first_point[1]+last_point[1])//2))
 
-            self.get_i(0)[0] = new_point
-            self.get_i(-1)[1] = new_point
+            self.set_point(0, new_point)
+            self.set_point(-1, new_point)
         
-        return self.get_edges()
+        return self.get_points()
     
     # Fuse nearby points within same path
     def fuse_points(self, max_dist):
 
-        # Auxiliary function
-        def dist_two_points(p1,p2):
-            return math.sqrt((p2[0]-p1[0])**2 + (p2[1]-p1[1])**2)
-
-        i = 0
+        # Fusion is done in a single pass. Kept and fused points are written
+        # to a new list, whose last point is the one compared with the next
+        # unread point
+        in_points = [tuple(p) for p in self.points.tolist()]
+        n = len(in_points)
 
-        while i < self.get_edges_len() and self.get_edges_len() >= 10:
+        points = in_points[:1]
+        j = 1
+        edges = n-1
 
-            first_point = self.get_i(i)[0]
-            last_point = self.get_i(i)[1]
+        while j < n and edges >= 10:
 
-            p_dist = dist_two_points(first_point,last_point)
+            first_point = points[-1]
+            last_point = in_points[j]
 
             # If distance less than max, fuse points
-            if p_dist <= max_dist:
+            if dist_at_most(first_point, last_point, max_dist):
+                edges -= 1
 
                 # If first or last edge, new point is endpoint
-                if i == 0:
-                    self.get_i(1)[0] = self.get_i(0)[0]
-                    self.delete(0)
+                if len(points) == 1:
+                    j += 1
 
-                elif i == self.get_edges_len()-1:
-                    self.get_i(i-1)[1] = self.get_i(i)[1]
-                    self.delete(i)
+                elif j == n-1:
+                    points.pop()
+                    break
                 
                 else:
                     new_x = (first_point[0]+last_point[0])//2
                     new_y = (first_point[1]+last_point[1])//2
-                    new_point = (new_x, new_y)
-
-                    self.get_i(i-1)[1] = new_point
-                    self.get_i(i+1)[0] = new_point
-                    self.delete(i)
+                    points[-1] = (new_x, new_y)
+                    j += 1
             
             else:
-                i += 1
+                points.append(last_point)
+                j += 1
 
-        return self.get_edges()
+        points.extend(in_points[j:])
+
+        self.points = np.array(points, dtype=np.int32)
+        return self.get_points()
+    
+    # Check if path is a closed loop with more than 2 edges
+    def is_loop(self):
+        first_point = self.get_point(0)
+        last_point = self.get_point(-1)
+
+        return first_point == last_point and self.get_edges_len() > 2
+    
+    # Check if path has 4 or less edges, all shorter than max_dist*2
+    def is_small_polygon(self, max_dist):
+
+        if self.get_edges_len() > 4:
+            return False
+
+        edges = np.diff(self.get_points(), axis=0).astype(np.float64)
+        lengths = np.sqrt(edges[:,0]**2 + edges[:,1]**2)
+
+        return bool((lengths <= max_dist*2).all())
 
 
 
@@ -470,97 +558,86 @@ class Graph:
     def get_canny(self):
         return self.get_img().get_canny()
     
+    def get_bw(self):
+        return self.get_img().get_bw()
+
+    # Copy graph and its paths into image
+    def copy(self, img):
+        new_graph = Graph(img)
+        new_graph.paths = [path.copy(new_graph) for path in self.get_paths()]
+        return new_graph
+    
     ##############
     #   MAKERS   #
     ##############
 
-    # Generate paths from canny image 
-    def make_edges(self):
+    # Generate edges between adjacent pixels of canny image, or of the given
+    # canny mask
+    # Returns an int32 array of shape (N,2,2), where each edge
+    # is [(x,y),(x+dx,y+dy)], sorted by pixel in row-major order
+    # and then by direction (right, bottom, bottom right, bottom left)
+    def make_edges(self, canny=None):
+
+        if canny is None:
+            canny = self.get_canny()
+        h, w = canny.shape
+
+        # Pad mask with black pixels so every shifted view has the same shape
+        mask = np.zeros((h+2, w+2), dtype=bool)
+        mask[1:-1,1:-1] = canny > 0
+
+        p = mask[1:-1,1:-1]
+        r = p & mask[1:-1,2:]
+        b = p & mask[2:,1:-1]
+        l = mask[1:-1,:-2]
+
+        # Diagonals ONLY IF not connected with adjacent pixels
+        br = p & mask[2:,2:] & ~b & ~r
+        bl = p & mask[2:,:-2] & ~b & ~l
+
+        # Direction offsets, in the same order as the masks
+        dirs = np.array([(1,0),(0,1),(1,1),(-1,1)], dtype=np.int32)
+
+        keys = []
+        for d, dir_mask in enumerate((r, b, br, bl)):
+            keys.append(np.flatnonzero(dir_mask)*4 + d)
 
-        canny = self.get_canny()
-
-        # Array with all generated edges
-        edges = []
-
-        # For every pixel in the array
-        for i in range(len(canny)):
-            for j in range(len(canny[0])):
-
-                # If pixel is not black
-                if canny[i][j] > 0:
-
-                    # Check if adjacent pixels exist
-                    right = j < len(canny[0])-1
-                    down = i < len(canny)-1
-                    left = j > 0
-
-                    # Variables symbolizing adjacent pixels
-                    r, br, b, bl, l = False, False, False, False, False
-
-                    # If adjacent pixels exist, set to True if not black
-                    if right:
-                        r = canny[i][j+1] > 0
-                    
-                    if down:
-                        b = canny[i+1][j] > 0
-
-                        if left:
-                            bl = canny[i+1][j-1] > 0
-
-                        if right:
-                            br = canny[i+1][j+1] > 0
-                    
-                    if left:
-                        l = canny[i][j-1] > 0
-
-                    # If right pixel is white, append vector to list
-                    if r:
-                        edges.append([(j,i),(j+1,i)])
-
-                    # If bottom pixel is white, append vector to list
-                    if b:
-                        edges.append([(j,i),(j,i+1)])
-
-                    # If bottom right pixel is white, append vector to list
-                    # ONLY IF not connected with right and bottom pixels
-                    if br:
-                        if not b and not r:
-                            edges.append([(j,i),(j+1,i+1)])
-                    
-                    # If bottom left pixel is white, append vector to list
-                    # ONLY IF not connected with bottom and left pixels
-                    if bl:
-                        if not b and not l:
-                            edges.append([(j,i),(j-1,i+1)])
-
-        return edges
+        keys = np.sort(np.concatenate(keys))
+
+        pixel = keys//4
+        start = np.stack((pixel%w, pixel//w), axis=1).astype(np.int32)
+        end = start + dirs[keys%4]
+
+        return np.stack((start, end), axis=1)
     
     # Generate a list of edge lists
-    def make_paths(self):
+    # Edges are taken from make_edges if not given
+    def make_paths(self, edges=None):
 
-        edge_list = self.make_edges()
+        if edges is None:
+            edges = self.make_edges()
 
-        # Auxiliary function
-        def get_angle(p1,p2,q1,q2):
-            v1 = [(p2[0]-p1[0]),(p2[1]-p1[1])]
-            v2 = [(q2[0]-q1[0]),(q2[1]-q1[1])]
+        edge_list = [[tuple(e[0]), tuple(e[1])] for e in edges.tolist()]
 
-            dot = v1[0]*v2[0] + v1[1]*v2[1]
+        # Index from pixel coordinates to incident edges, in edge list order
+        incident = {}
+        for k in range(len(edge_list)):
+            for p in edge_list[k]:
+                incident.setdefault(p, []).append(k)
 
-            mv1 = math.sqrt(v1[0]**2+v1[1]**2)
-            mv2 = math.sqrt(v2[0]**2+v2[1]**2)
+        # Used edges are marked as removed instead of deleted from the list
+        removed = [False]*len(edge_list)
+        remaining = len(edge_list)
+        next_seed = 0
 
-            a = dot/(mv1*mv2)
-            if a > 1:
-                a = 1
-            if a < -1:
-                a = -1
+        # Get remaining edges with p as endpoint
+        def get_candidates(p):
+            return [k for k in incident[p] if not removed[k]]
 
-            return int(math.degrees(math.acos(a)))
-        
         # Initialize path array
         path_list = []
 
+        # Vertices of current path, frozen into a Path when finished
         curr_path = None
         search_start = True
         search_end = True
@@ -568,56 +645,55 @@ class Graph:
         while True:
 
             # If no more vectors remain in list, exit loop
-            if len(edge_list) <= 0:
+            if remaining <= 0:
                 if curr_path is not None:
                     path_list.append(curr_path)
                 break
 
-            # If starting a new path, append first vector of list
+            # If starting a new path, append first remaining vector of list
             if not curr_path:
-                curr_path = Path(self)
-                curr_path.add(edge_list.pop(0))
+                while removed[next_seed]:
+                    next_seed += 1
+
+                curr_path = deque(edge_list[next_seed])
+                removed[next_seed] = True
+                remaining -= 1
                 search_start = True
                 search_end = True
 
-            # Arrays for candidate vectors
+            # Arrays for candidate vector indices
             found_start = []
             found_end = []
 
-            # For every remaining element in vector list
-            for i in range(len(edge_list)):
+            if search_start:
 
-                if search_start:
+                # Get first point from current path
+                first_point = curr_path[0]
 
-                    # Get first edge from current path
-                    first_edge = curr_path.get_first()
+                for k in get_candidates(first_point):
 
-                    # Check for coincidence in endpoints
-                    if first_edge[0] in edge_list[i]:
+                    # If starting point is the same, flip obtained edge
+                    if first_point == edge_list[k][0]:
+                        edge_list[k][0], edge_list[k][1] = edge_list[k][1], edge_list[k][0]
 
-                        # If starting point is the same, flip obtained edge
-                        if first_edge[0] == edge_list[i][0]:
-                            edge_list[i][0], edge_list[i][1] = edge_list[i][1], edge_list[i][0]
+                    found_start.append(k) # Append to first candidate list
 
-                        found_start.append(edge_list[i]) # Append to first candidate list
+            if search_end:
 
-                if search_end:
+                # Get last point from current path
+                last_point = curr_path[-1]
 
-                    # Get last edge from current path
-                    last_edge = curr_path.get_last()
+                for k in get_candidates(last_point):
 
-                    # Check for coincidence in endpoints
-                    if  last_edge[1] in edge_list[i]:
+                    # If not already in candidate list
+                    if k not in found_start:
 
-                        # If not already in candidate list
-                        if edge_list[i] not in found_start:
+                        # If ending point is the same, flip obtained edge
+                        if last_point == edge_list[k][1]:
+                            edge_list[k][0], edge_list[k][1] = edge_list[k][1], edge_list[k][0]
 
-                            # If ending point is the same, flip obtained edge
-                            if last_edge[1] == edge_list[i][1]:
-                                edge_list[i][0], edge_list[i][1] = edge_list[i][1], edge_list[i][0]
+                        found_end.append(k) # Append to candidate list
 
-                            found_end.append(edge_list[i]) # Append to candidate list
-            
             # If no candidate edges were found, start new path
             if len(found_start) == 0 and len(found_end) == 0:
                 path_list.append(curr_path)
@@ -629,20 +705,21 @@ class Graph:
                 best_match = 360
                 best_i = -1
 
-                # For every element in found_start
-                for i in range(len(found_start)):
+                # Current vector is combination of last 5 vectors
+                if len(curr_path)-1 >= 5:
+                    curr = (curr_path[0], curr_path[5])
+                else:
+                    curr = (curr_path[0], curr_path[-1])
 
-                    curr = curr_path.get_first()
+                # Closed loops can end where they start, first edge is used
+                if curr[0] == curr[1]:
+                    curr = (curr_path[0], curr_path[1])
 
-                    # Current vector is combination of last 5 vectors
-                    if curr_path.get_edges_len() >= 5:
-                        curr = (curr_path.get_first()[0], curr_path.get_i(4)[1])
-                    else:
-                        l = curr_path.get_edges_len() - 1
-                        curr = (curr_path.get_first()[0], curr_path.get_i(l)[1])
+                # For every element in found_start
+                for i in range(len(found_start)):
 
                     # Candidate vector
-                    cand = found_start[i]
+                    cand = edge_list[found_start[i]]
 
                     # Angle comparison
                     a = get_angle(curr[0],curr[1],cand[0],cand[1])
@@ -652,9 +729,11 @@ class Graph:
                         best_match = a
                         best_i = i
 
-                # Remove best candidate from v_list and add to current path
-                edge_list.remove(found_start[best_i])
-                curr_path.add_first(found_start.pop(best_i))
+                # Mark best candidate as removed and add to current path
+                best_k = found_start[best_i]
+                removed[best_k] = True
+                remaining -= 1
+                curr_path.appendleft(edge_list[best_k][0])
             
             else:
                 search_start = False
@@ -665,18 +744,21 @@ class Graph:
                 best_match = 360
                 best_i = -1
 
+                # Current edge is combination of last 5 edges
+                if len(curr_path)-1 >= 5:
+                    curr = (curr_path[-6], curr_path[-1])
+                else:
+                    curr = (curr_path[0], curr_path[-1])
+
+                # Closed loops can end where they start, last edge is used
+                if curr[0] == curr[1]:
+                    curr = (curr_path[-2], curr_path[-1])
+
                 # For every element in found_end
                 for i in range(len(found_end)):
 
-                    # Current edge is combination of last 5 edges
-                    if curr_path.get_edges_len() >= 5:
-                        curr = (curr_path.get_i(-5)[0], curr_path.get_last()[1])
-                    else:
-                        l = curr_path.get_edges_len()
-                        curr = (curr_path.get_i(-l)[0], curr_path.get_last()[1])
-
                     # Candidate vector
-                    cand = found_end[i]
+                    cand = edge_list[found_end[i]]
 
                     # Angle comparison
                     a = get_angle(curr[0],curr[1],cand[0],cand[1])
@@ -686,24 +768,115 @@ class Graph:
                         best_match = a
                         best_i = i
                 
-                # Remove best candidate from v_list and add to current path
-                edge_list.remove(found_end[best_i])
-                curr_path.add(found_end.pop(best_i))
+                # Mark best candidate as removed and add to current path
+                best_k = found_end[best_i]
+                removed[best_k] = True
+                remaining -= 1
+                curr_path.append(edge_list[best_k][1])
             
             else:
                 search_end = False
 
         # Paths with only one edge are removed
-        i = 0
-        while i < len(path_list):
-            if path_list[i].get_edges_len() <= 1:
-                path_list.pop(i)
-            else:
-                i += 1
+        path_list = [Path(self, np.array(p, dtype=np.int32)) for p in path_list if len(p) > 2]
+
+        self.paths = path_list
+        return self.paths
+    
+    # Generate closed paths from the contours of the black-white image
+    # Holes are taken from the contour hierarchy, so final_processing isn't
+    # needed. If holes is False containers are left for final_processing
+    def make_contours(self, holes=True):
+
+        inverted = cv2.bitwise_not(self.get_bw())
+        mode = cv2.RETR_CCOMP if holes else cv2.RETR_LIST
+        contours, hierarchy = cv2.findContours(inverted, mode, cv2.CHAIN_APPROX_NONE)
+
+        path_list = []
+
+        for i in range(len(contours)):
+            points = contours[i][:,0]
+
+            # Contours with less than 3 points can't form a polygon
+            if len(points) < 3:
+                continue
+
+            # Closed path, first point is repeated at the end
+            new_path = Path(self, np.concatenate((points, points[:1])).astype(np.int32))
+
+            # In a two-level hierarchy, contours with a parent are holes
+            if holes and hierarchy[0][i][3] != -1:
+                new_path.add_container()
+
+            path_list.append(new_path)
 
         self.paths = path_list
         return self.paths
     
+    # Remove traced fragments that can't reach the final output
+    # A fragment is isolated if no endpoint of another path is closer than
+    # max_dist to its endpoints, so fuse_ends never joins it. Isolated paths
+    # are removed if their ends are too far apart to be closed, if they have
+    # 4 or less edges that can't be longer than fuse_dist*2, if they have less
+    # than min_len edges, or if both sides of their bounding box are shorter
+    # than min_size. Paths are only compared through their original endpoints,
+    # so the result doesn't depend on which fragments were removed
+    def remove_fragments(self, max_dist, fuse_dist, min_len=0, min_size=0):
+
+        paths = self.get_paths()
+
+        # Grid cell to indices of paths with an endpoint in the cell
+        grid = {}
+        cell_size = max(max_dist, 1)
+
+        def get_cell(p):
+            return (int(p[0]//cell_size), int(p[1]//cell_size))
+        
+        def get_endpoints(k):
+            return (paths[k].get_point(0), paths[k].get_point(-1))
+
+        # Same condition as fuse_ends
+        def isolated(k):
+            for p in get_endpoints(k):
+                x, y = get_cell(p)
+                for dx in (-1,0,1):
+                    for dy in (-1,0,1):
+                        for j in grid.get((x+dx,y+dy), ()):
+                            if j == k:
+                                continue
+                            for q in get_endpoints(j):
+                                if dist_less(p, q, max_dist):
+                                    return False
+            return True
+
+        def removable(k):
+            path = paths[k]
+            n = path.get_edges_len()
+            first_point, last_point = get_endpoints(k)
+
+            # Never closed by close_loops, removed by keep_loops
+            if not dist_at_most(first_point, last_point, max_dist):
+                return True
+
+            # Reduction only keeps traced vertices and loop closing moves the
+            # endpoints inside the bounding box, so no edge can be longer
+            # than its diagonal
+            min_x, min_y, max_x, max_y = path.update_bounding_box()
+            width = max_x - min_x
+            height = max_y - min_y
+
+            if n <= 4 and dist_at_most((min_x,min_y), (max_x,max_y), fuse_dist*2):
+                return True
+            
+            return n < min_len or (width < min_size and height < min_size)
+
+        for k in range(len(paths)):
+            for p in get_endpoints(k):
+                grid.setdefault(get_cell(p), set()).add(k)
+
+        self.paths = [paths[k] for k in range(len(paths)) if not (removable(k) and isolated(k))]
+        return self.get_paths()
+    
     ###############
     #  REDUCTION  #
     ###############
@@ -726,16 +899,29 @@ class Graph:
         if max_dist < 1:
             return self.get_paths()
 
-        for path in self.get_paths():
-            path.edge_reduce_variable(max_dist)
+        greedy_reduce(self.get_paths(), max_dist)
 
         return self.get_paths()
     
     # Applies hybrid edge reduction method to all paths
     def edge_reduce_threshold(self, reduction_limit, max_dist):
 
+        # If reduction_limit is 0, return original array
+        if reduction_limit == 0:
+            return self.get_paths()
+
+        greedy_reduce(self.get_paths(), max_dist, reduction_limit)
+
+        return self.get_paths()
+    
+    # Applies Douglas-Peucker edge reduction method to all paths
+    def edge_reduce_dp(self, max_dist):
+
+        if max_dist <= 0:
+            return self.get_paths()
+
         for path in self.get_paths():
-            path.edge_reduce_threshold(reduction_limit, max_dist)
+            path.edge_reduce_dp(max_dist)
 
         return self.get_paths()
     
@@ -744,76 +930,117 @@ class Graph:
     ###################
 
     # Fuse paths with close endpoints
+    # Endpoints are indexed in a uniform grid with cell size max_dist,
+    # so only paths with endpoints in neighboring cells are compared
     def fuse_ends(self, max_dist):
 
-        # Auxiliary function
-        def dist_two_points(p1,p2):
-            return math.sqrt((p2[0]-p1[0])**2 + (p2[1]-p1[1])**2)
+        # Endpoints at distance 0 are never fused
+        if max_dist <= 0:
+            return self.get_paths()
+
+        paths = list(self.get_paths())
+
+        # Grid cell to indices of paths with an endpoint in the cell
+        grid = {}
+
+        def get_cell(p):
+            return (int(p[0]//max_dist), int(p[1]//max_dist))
         
-        i = 0
+        def get_endpoints(k):
+            return (paths[k].get_point(0), paths[k].get_point(-1))
 
-        while i < len(self.get_paths()):
+        def grid_add(k):
+            for p in get_endpoints(k):
+                grid.setdefault(get_cell(p), set()).add(k)
 
-            j = i+1
+        # Must be called before the endpoints of path k change
+        def grid_remove(k):
+            for p in get_endpoints(k):
+                grid[get_cell(p)].discard(k)
 
-            while j < len(self.get_paths()):
+        # Indices of paths with an endpoint closer than max_dist to p
+        # are always in the 3x3 block of cells around p
+        def grid_near(p):
+            x, y = get_cell(p)
+            near = set()
+            for dx in (-1,0,1):
+                for dy in (-1,0,1):
+                    near.update(grid.get((x+dx,y+dy), ()))
+            return near
 
-                curr_path = self.get_paths()[i]
+        for k in range(len(paths)):
+            grid_add(k)
 
-                first_curr = curr_path.get_i(0)[0]
-                last_curr = curr_path.get_i(-1)[1]
+        for i in range(len(paths)):
 
-                comp_path = self.get_paths()[j]
+            # Skip paths fused with a previous path
+            if paths[i] is None:
+                continue
 
-                first_comp = comp_path.get_i(0)[0]
-                last_comp = comp_path.get_i(-1)[1]
+            # Previous paths are never compared again
+            grid_remove(i)
 
-                c1 = dist_two_points(first_curr, last_comp) < max_dist
-                c2 = dist_two_points(first_curr, first_comp) < max_dist
-                c3 = dist_two_points(first_comp, last_curr) < max_dist
-                c4 = dist_two_points(last_comp, last_curr) < max_dist
+            fused = True
 
-                if c1 or c2:
+            while fused:
 
-                    if c2:
-                        comp_path.change_orientation()
-                        new_point = (((first_curr[0]+first_comp[0])//2),((first_curr[1]+first_comp[1])//2))
-                    else:
-                        new_point = (((first_curr[0]+last_comp[0])//2),((first_curr[1]+last_comp[1])//2))
+                fused = False
 
-                    curr_path.get_i(0)[0] = new_point
-                    comp_path.get_i(-1)[1] = new_point
+                curr_path = paths[i]
 
-                    new_prev = self.get_paths().pop(j)
-                    old_path = self.get_paths()[i]
+                first_curr = curr_path.get_point(0)
+                last_curr = curr_path.get_point(-1)
 
-                    self.get_paths()[i] = new_prev
-                    self.get_paths()[i].append(old_path)
+                # Candidates are compared in list order, the first match is fused
+                for j in sorted(grid_near(first_curr) | grid_near(last_curr)):
 
-                    j = i+1
+                    comp_path = paths[j]
 
-                elif c3 or c4:
+                    first_comp = comp_path.get_point(0)
+                    last_comp = comp_path.get_point(-1)
 
-                    if c4:
-                        comp_path.change_orientation()
-                        new_point = (((last_comp[0]+last_curr[0])//2),((last_comp[1]+last_curr[1])//2))
-                    else:
-                        new_point = (((first_comp[0]+last_curr[0])//2),((first_comp[1]+last_curr[1])//2))
+                    c1 = dist_less(first_curr, last_comp, max_dist)
+                    c2 = dist_less(first_curr, first_comp, max_dist)
+                    c3 = dist_less(first_comp, last_curr, max_dist)
+                    c4 = dist_less(last_comp, last_curr, max_dist)
 
-                    comp_path.get_i(0)[0] = new_point
-                    curr_path.get_i(-1)[1] = new_point
+                    if not (c1 or c2 or c3 or c4):
+                        continue
 
-                    new_next = self.get_paths().pop(j)
+                    grid_remove(j)
+                    paths[j] = None
+                    fused = True
 
-                    self.get_paths()[i].append(new_next)
+                    if c1 or c2:
 
-                    j = i+1
+                        if c2:
+                            comp_path.change_orientation()
+                            new_point = (((first_curr[0]+first_comp[0])//2),((first_curr[1]+first_comp[1])//2))
+                        else:
+                            new_point = (((first_curr[0]+last_comp[0])//2),((first_curr[1]+last_comp[1])//2))
 
-                else:
-                    j += 1
-            
-            i += 1
+                        curr_path.set_point(0, new_point)
+                        comp_path.set_point(-1, new_point)
 
+                        paths[i] = comp_path
+                        paths[i].append(curr_path)
+
+                    else:
+
+                        if c4:
+                            comp_path.change_orientation()
+                            new_point = (((last_comp[0]+last_curr[0])//2),((last_comp[1]+last_curr[1])//2))
+                        else:
+                            new_point = (((first_comp[0]+last_curr[0])//2),((first_comp[1]+last_curr[1])//2))
+
+                        comp_path.set_point(0, new_point)
+                        curr_path.set_point(-1, new_point)
+
+                        paths[i].append(comp_path)
+
+                    break
+
+        self.paths = [p for p in paths if p is not None]
         return self.get_paths()
     
     # Make loops in paths with similar start and end points
@@ -826,20 +1053,7 @@ class Graph:
     
     # Keep only closed loops, remove other paths
     def keep_loops(self):
-
-        i = 0
-
-        while i < len(self.get_paths()):
-            curr_path = self.get_paths()[i]
-
-            first_point = curr_path.get_i(0)[0]
-            last_point = curr_path.get_i(-1)[1]
-
-            if first_point != last_point or len(curr_path.get_edges()) <= 2:
-                self.get_paths().pop(i)
-            else:
-                i += 1
-        
+        self.paths = [path for path in self.get_paths() if path.is_loop()]
         return self.get_paths()
     
     # Nearby points within same path
@@ -852,39 +1066,115 @@ class Graph:
     
     # Remove small polygons
     def remove_small_polygons(self, max_dist):
-
-        # Auxiliary function
-        def dist_two_points(p1,p2):
-            return math.sqrt((p2[0]-p1[0])**2 + (p2[1]-p1[1])**2)
-
-        i = 0
-
-        while i < len(self.get_paths()):
-            curr_path = self.get_paths()[i]
-            remove = False
-
-            if curr_path.get_edges_len() <= 4:
-                remove = True
-                for edge in curr_path.get_edges():
-                    edge_length = dist_two_points(edge[0],edge[1])
-                    if edge_length > max_dist*2:
-                        remove = False
-                if remove:
-                    self.get_paths().pop(i)
-            
-            if not remove:
-                i += 1
-        
+        self.paths = [path for path in self.get_paths() if not path.is_small_polygon(max_dist)]
+        return self.get_paths()
+    
+    # Close, filter and fuse paths in a single pass
+    # Each path goes through close_loops, keep_loops, fuse_points and
+    # remove_small_polygons before the next one is read, and is dropped as soon
+    # as it fails a filter
+    def post_process(self, max_dist, fuse_dist):
+
+        def closed_loops(paths):
+            for path in paths:
+                path.close_loops(max_dist)
+                if path.is_loop():
+                    yield path
+
+        def fused(paths):
+            for path in paths:
+                path.fuse_points(fuse_dist)
+                yield path
+
+        def large_polygons(paths):
+            for path in paths:
+                if not path.is_small_polygon(fuse_dist):
+                    yield path
+
+        self.paths = list(large_polygons(fused(closed_loops(self.get_paths()))))
         return self.get_paths()
     
     # Generate holes and hole points
+    # Containers are counted in a single sweep over the image rows. The first
+    # point of each path is only tested against the edges crossing its row,
+    # for paths whose bounding box can contain it
     def final_processing(self):
 
-        for i in range(len(self.get_paths())):
-            for j in range(len(self.get_paths())):
-                if i != j:
-                    self.get_paths()[i].container_check(self.get_paths()[j])
+        paths = self.get_paths()
+
+        # Non horizontal edges as (upper y, lower y, path index, edge), sorted by upper y
+        edge_list = []
+        for k in range(len(paths)):
+            paths[k].update_bounding_box()
+            for e in paths[k].get_edges():
+                upper, lower = sorted(e, key=lambda v: v[1])
+                if upper[1] < lower[1]:
+                    edge_list.append((upper[1], lower[1], k, e))
+        edge_list.sort(key=lambda e: e[0])
+
+        # Paths sorted by row of their first point
+        queries = sorted(range(len(paths)), key=lambda k: paths[k].get_point(0)[1])
+
+        # Path index to {edge number: edge} of edges crossing the current row
+        active = {}
+        next_e = 0
+
+        # Heap of (lower y, edge number, path index) of active edges, every
+        # edge is removed once when the sweep passes its lower end
+        ending = []
+
+        # Indices of containing paths for each path
+        containers = [[] for _ in paths]
+
+        for i in queries:
+            x, y = paths[i].get_point(0)
+
+            # Add edges starting at or above the current row
+            while next_e < len(edge_list) and edge_list[next_e][0] <= y:
+                _, lower_y, k, e = edge_list[next_e]
+                active.setdefault(k, {})[next_e] = e
+                heapq.heappush(ending, (lower_y, next_e, k))
+                next_e += 1
+
+            # Remove edges ending at or above the current row
+            while len(ending) > 0 and ending[0][0] <= y:
+                _, n, k = heapq.heappop(ending)
+                del active[k][n]
+                if len(active[k]) == 0:
+                    del active[k]
+
+            for k in active:
+
+                # Point to the right of bounding box can't be contained
+                if k == i or x >= paths[k].get_bounding_box()[2]:
+                    continue
+
+                count = 0
+                for e in active[k].values():
+                    if get_intersection(e[0], e[1], y) > x:
+                        count += 1
+
+                # If odd, point is in polygon
+                if count%2 == 1:
+                    containers[i].append(k)
+                    paths[i].add_container()
+
+        # Innermost container is the one with the most containers
+        for i in range(len(paths)):
+            if len(containers[i]) > 0:
+                parent = max(containers[i], key=lambda k: paths[k].get_containers())
+                paths[i].set_parent(paths[parent])
         
+        self.update_hole_points()
+
+    # Get paths not contained in any other path, as roots of the nesting tree
+    # Children of each path are obtained with Path.get_children
+    def get_roots(self):
+        return [p for p in self.get_paths() if p.get_parent() is None]
+
+    # Generate hole points and orientations from the number of containers
+    def update_hole_points(self):
+
         for path in self.get_paths():
             path.update_hole_point()
 
@@ -896,9 +1186,7 @@ class Graph:
     def format_paths(self):
         path_list = []
         for path in self.get_paths():
-            new_path = []
-            for i in range(path.get_edges_len()):
-                new_path.append(path.get_i(i)[0])
+            new_path = [tuple(p) for p in path.get_points()[:-1].tolist()]
             path_list.append((new_path,path.get_hole_point()))
         return path_list
     
@@ -909,13 +1197,88 @@ class Graph:
     def print_orientations(self):
         for p in self.get_paths():
             print(p.orientation())
+    
+    ###############
+    #  PARALLEL   #
+    ###############
+
+    # Run a per-path stage in worker processes
+    # Paths are split in size-balanced chunks, and every chunk is sent as one
+    # vertex array with the vertex count of each path. Paths kept by the stage
+    # stay in the same order
+    def run_stage(self, stage, args, workers=1):
+
+        paths = self.get_paths()
+
+        if workers <= 1 or len(paths) < 2:
+            return getattr(self, stage)(*args)
+
+        # Largest paths first, each one to the chunk with less vertices
+        n_chunks = min(len(paths), workers*4)
+        chunks = [[] for _ in range(n_chunks)]
+        sizes = [(0, c) for c in range(n_chunks)]
+
+        for k in sorted(range(len(paths)), key=lambda k: -len(paths[k].get_points())):
+            size, c = heapq.heappop(sizes)
+            chunks[c].append(k)
+            heapq.heappush(sizes, (size + len(paths[k].get_points()), c))
+
+        payloads = []
+        for chunk in chunks:
+            chunk.sort()
+            points = [paths[k].get_points() for k in chunk]
+            lengths = np.array([len(p) for p in points])
+            payloads.append((stage, args, np.concatenate(points), lengths))
+
+        kept = []
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for chunk, result in zip(chunks, executor.map(run_stage_chunk, payloads)):
+                chunk_kept, points, lengths = result
+                for i, p in zip(chunk_kept, np.split(points, np.cumsum(lengths)[:-1])):
+                    paths[chunk[i]].points = p
+                    kept.append(chunk[i])
+
+        kept.sort()
+        self.paths = [paths[k] for k in kept]
+        return self.get_paths()
+
+
+# Run a Graph stage on a chunk of paths, in a worker process
+# Returns the positions in the chunk of the paths kept by the stage, and their
+# vertex arrays in the same format as the payload
+def run_stage_chunk(payload):
+    stage, args, points, lengths = payload
+
+    graph = Graph(None)
+    graph.paths = [Path(graph, p) for p in np.split(points, np.cumsum(lengths)[:-1])]
+    position = {id(path): i for i, path in enumerate(graph.get_paths())}
+
+    getattr(graph, stage)(*args)
+
+    kept = [position[id(path)] for path in graph.get_paths()]
+    new_points = [path.get_points() for path in graph.get_paths()]
 
+    if len(new_points) == 0:
+        return kept, np.zeros((0,2), dtype=np.int32), np.zeros(0, dtype=int)
+
+    return kept, np.concatenate(new_points), np.array([len(p) for p in new_points])
+
+
+# Paint connected components of given color smaller than min_area
+# with the opposite color, label 0 is the rest of the image
+def remove_components(img, color, min_area):
+    mask = (img == color).astype(np.uint8)
+    _, labels, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    small = stats[:, cv2.CC_STAT_AREA] < min_area
+    small[0] = False
+    img[small[labels]] = 255 - color
+    return img
 
 # Image class, always associated to graph
 class Image:
 
     # Image object
-    def __init__(self, filename, t_lower, t_upper, bw_thresh):
+    def __init__(self, filename, t_lower, t_upper, bw_thresh, min_area=0, edge_mode="canny"):
         self.filename = filename
 
         color_img = cv2.imread(self.filename) # Color image
@@ -985,9 +1348,23 @@ class Image:
         bw_canvas[y_pos:y_pos+h, x_pos:x_pos+w] = cropped_bw
         color_canvas[y_pos:y_pos+h, x_pos:x_pos+w] = cropped_color
 
+        # Remove black blobs, then white holes
+        if min_area > 0:
+            bw_canvas = remove_components(bw_canvas, 0, min_area)
+            bw_canvas = remove_components(bw_canvas, 255, min_area)
+
         self.original = color_canvas
-        self.canny = cv2.Canny(bw_canvas, t_lower, t_upper)
+        self.bw = bw_canvas
+
+        # Black-white canvas has no gradients, its outline can be used directly
+        self.edge_mode = edge_mode
+        if edge_mode[0] == "b":
+            self.canny = boundary_mask(bw_canvas).astype(np.uint8)*255
+        else:
+            self.canny = cv2.Canny(bw_canvas, t_lower, t_upper)
+
         self.graph = None
+        self.workers = 1    # Processes for per-path stages
 
     ###############
     #   GETTERS   #
@@ -1012,14 +1389,41 @@ class Image:
     def set_graph(self, graph):
         self.graph = graph
 
+    def set_workers(self, workers):
+        self.workers = workers
+
+    # Copy image with its graph, so that later stages can be run more than
+    # once from the same traced paths. Black-white and canny images are shared
+    def copy(self):
+        new_img = copy.copy(self)
+        if self.original is not None:
+            new_img.original = self.original.copy()
+        if self.graph is not None:
+            new_img.graph = self.graph.copy(new_img)
+        return new_img
+
     ################
     # INITIALIZERS #
     ################
 
     # Initialize graph object
+    # In boundary mode the region boundaries are traced directly, so regions
+    # that touch each other or a thin line are still closed paths
     def make_edges(self):
         self.set_graph(Graph(self))
-        self.get_graph().make_paths()
+        if self.edge_mode[0] == "b":
+            self.get_graph().make_contours(False)
+        else:
+            self.get_graph().make_paths()
+
+    # Initialize graph object from image contours
+    def make_contours(self):
+        self.set_graph(Graph(self))
+        self.get_graph().make_contours()
+
+    # Remove isolated fragments after tracing
+    def remove_fragments(self, max_dist, fuse_dist, min_len=0, min_size=0):
+        self.get_graph().remove_fragments(max_dist, fuse_dist, min_len, min_size)
 
     #####################
     # WRAPPER FUNCTIONS #
@@ -1029,30 +1433,42 @@ class Image:
     def edge_reduce(self, type, params):
         match type[0]:
             case "f":
-                self.get_graph().edge_reduce_constant(params[0])
+                self.run_stage("edge_reduce_constant", (params[0],))
             case "v":
-                self.get_graph().edge_reduce_variable(params[0])
+                self.run_stage("edge_reduce_variable", (params[0],))
             case "h":
-                self.get_graph().edge_reduce_threshold(params[0], params[1])
+                self.run_stage("edge_reduce_threshold", (params[0], params[1]))
+            case "d":
+                self.run_stage("edge_reduce_dp", (params[0],))
+
+    # Run per-path stage with the image workers
+    def run_stage(self, stage, args):
+        self.get_graph().run_stage(stage, args, self.workers)
     
     def fuse_ends(self, max_dist):
         self.get_graph().fuse_ends(max_dist)
 
     def close_loops(self, max_dist):
-        self.get_graph().close_loops(max_dist)
+        self.run_stage("close_loops", (max_dist,))
 
     def keep_loops(self):
         self.get_graph().keep_loops()
 
     def fuse_points(self, max_dist):
-        self.get_graph().fuse_points(max_dist)
+        self.run_stage("fuse_points", (max_dist,))
 
     def remove_small_polygons(self, max_dist):
         self.get_graph().remove_small_polygons(max_dist)
 
+    def post_process(self, max_dist, fuse_dist):
+        self.run_stage("post_process", (max_dist, fuse_dist))
+
     def final_processing(self):
         self.get_graph().final_processing()
 
+    def update_hole_points(self):
+        self.get_graph().update_hole_points()
+
     def format_paths(self):
         return self.get_graph().format_paths()
 
@@ -0,0 +1,341 @@
+import os
+import struct
+import tempfile
+import zlib
+from PIL import Image as PILImage
+from .canny import *
+
+# Rows converted at a time when the whole image has to be read
+BAND_ROWS = 1024
+
+# Pixels decoded at a time when the image is read by bands
+BAND_PIXELS = 1 << 22
+
+# Pixels around every tile used for edge detection, so edges in the tile are
+# the same as in the full canvas
+TILE_MARGIN = 16
+
+# Compressed bytes read from a PNG file at a time, and most bytes
+# decompressed at a time
+PNG_READ = 1 << 20
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# PIL mode and bits per pixel of every PNG (color type, bit depth) that can
+# be read by rows
+PNG_MODES = {
+    (0, 1): ("1", 1),
+    (0, 8): ("L", 8),
+    (2, 8): ("RGB", 24),
+    (3, 8): ("P", 8),
+    (4, 8): ("LA", 16),
+    (6, 8): ("RGBA", 32),
+}
+
+# Width, height, PIL mode and bits per pixel of a PNG image that can be read
+# by rows, None for other images (interlaced or 16 bit PNG, other formats)
+def png_header(filename):
+    with open(filename, "rb") as f:
+        if f.read(8) != PNG_SIGNATURE:
+            return None
+        _, kind = struct.unpack(">I4s", f.read(8))
+        if kind != b"IHDR":
+            return None
+        w, h, depth, color, _, _, interlace = struct.unpack(">IIBBBBB", f.read(13))
+
+    if interlace != 0 or (color, depth) not in PNG_MODES:
+        return None
+
+    return (w, h) + PNG_MODES[(color, depth)]
+
+# Grey rows of a PNG image in bands of at most rows rows, with the same
+# values as cv2.imread and cv2.cvtColor. Only one band and its compressed
+# data are in memory at a time
+def png_grey_bands(filename, rows):
+    w, h, mode, bits = png_header(filename)
+    stride = (w*bits + 7)//8
+
+    inflate = zlib.decompressobj()
+    data = bytearray()
+    palette = None
+    prev = None
+    y = 0
+
+    with open(filename, "rb") as f:
+        f.seek(len(PNG_SIGNATURE))
+
+        while y < h:
+            length, kind = struct.unpack(">I4s", f.read(8))
+
+            if kind == b"PLTE":
+                palette = f.read(length)
+                f.seek(4, 1)
+                continue
+
+            if kind != b"IDAT":
+                if kind == b"IEND":
+                    raise ValueError("PNG image data ends before last row")
+                f.seek(length+4, 1)
+                continue
+
+            remaining = length
+            while remaining > 0:
+                piece = f.read(min(remaining, PNG_READ))
+                remaining -= len(piece)
+
+                while len(piece) > 0:
+                    data += inflate.decompress(piece, PNG_READ)
+                    piece = inflate.unconsumed_tail
+
+                    # Every row is a filter type byte and the filtered row
+                    n = min(rows, h-y)
+                    while y < h and len(data) >= n*(stride+1):
+                        grey, prev = png_band(data[:n*(stride+1)], prev, mode, w, n, palette)
+                        del data[:n*(stride+1)]
+                        yield grey
+                        y += n
+                        n = min(rows, h-y)
+
+            f.seek(4, 1)
+
+# Decode n filtered rows of a PNG image, prev is the last row of the previous
+# band, unfiltered, which is added before the band with no filter because
+# filters of the first row use it
+# Returns grey band and its last row unfiltered
+def png_band(filtered, prev, mode, w, n, palette):
+    if prev is not None:
+        filtered = b"\x00" + prev + bytes(filtered)
+
+    size = (w, n if prev is None else n+1)
+    band = PILImage.frombytes(mode, size, zlib.compress(bytes(filtered), 0), "zip", mode)
+    last = band.crop((0, size[1]-1, w, size[1])).tobytes()
+
+    if mode == "P":
+        band.putpalette(palette, "RGB")
+
+    # Color images have no alpha channel, as in cv2.imread
+    if mode in ["1", "L", "LA"]:
+        grey = np.asarray(band.convert("L"))
+    else:
+        grey = cv2.cvtColor(np.asarray(band.convert("RGB")), cv2.COLOR_RGB2GRAY)
+
+    return grey[size[1]-n:], last
+
+# Read image and save black-white image to a .npy file in band_dir
+# PNG images are read by bands. Other images are decoded at once in color
+# and converted to grey as in Image, which needs memory for the whole image
+# Returns the file opened as a read-only memory map
+def threshold_to_file(filename, bw_thresh, band_dir):
+    header = png_header(filename)
+
+    if header is not None:
+        img_w, img_h = header[:2]
+        bands = png_grey_bands(filename, max(1, BAND_PIXELS//img_w))
+    else:
+        print("Advertencia: la imagen no es PNG de 8 bits sin entrelazado, se lee completa")
+        color_img = cv2.imread(filename)
+        img_h, img_w = color_img.shape[:2]
+        bands = (cv2.cvtColor(color_img[y0:y0+BAND_ROWS], cv2.COLOR_BGR2GRAY) for y0 in range(0, img_h, BAND_ROWS))
+
+    # Bands are written to the file after the .npy header, so they aren't
+    # kept in memory as pages of a memory map
+    path = os.path.join(band_dir, "bw.npy")
+    bw = np.lib.format.open_memmap(path, mode="w+", dtype=np.uint8, shape=(img_h, img_w))
+    offset = bw.offset
+    del bw
+
+    with open(path, "r+b") as f:
+        f.seek(offset)
+        for grey_band in bands:
+            _, bw_band = cv2.threshold(grey_band, bw_thresh, 255, cv2.THRESH_BINARY)
+            f.write(bw_band.tobytes())
+
+    return np.load(path, mmap_mode="r")
+
+# Crop and canvas position used by Image, without building the canvas
+# Returns (x, y, w, h, x_pos, y_pos, canvas_dim): the image is cropped to
+# [y:y+h, x:x+w] and placed at [y_pos:y_pos+h, x_pos:x_pos+w] of a white
+# square canvas. The leftmost and rightmost black pixels of every row have
+# the same convex hull as the external black contours, so minAreaRect gives
+# the same rectangle
+def canvas_transform(bw):
+    img_h, img_w = bw.shape
+
+    all_points = []
+    for y0 in range(0, img_h, BAND_ROWS):
+        band = np.asarray(bw[y0:y0+BAND_ROWS]) == 0
+        rows = np.flatnonzero(band.any(axis=1))
+        if len(rows) == 0:
+            continue
+
+        left = band[rows].argmax(axis=1)
+        right = img_w - 1 - band[rows, ::-1].argmax(axis=1)
+
+        all_points.append(np.stack((left, rows+y0), axis=1))
+        all_points.append(np.stack((right, rows+y0), axis=1))
+
+    rect = cv2.minAreaRect(np.concatenate(all_points).astype(np.int32))
+
+    # Same as Image
+    box = np.int0(cv2.boxPoints(rect))
+
+    min_x, min_y = box.min(axis=0).tolist()
+    max_x, max_y = box.max(axis=0).tolist()
+
+    w = max_x - min_x
+    h = max_y - min_y
+
+    x = max(min_x, 0)
+    y = max(min_y, 0)
+
+    if h+y > img_h:
+        h = img_h
+        y = 0
+
+    if w+x > img_w:
+        w = img_w
+        x = 0
+
+    padding_x = round(w*0.1)
+    padding_y = round(h*0.1)
+    canvas_dim = max(h + padding_x*2, w + padding_y*2)
+
+    x_pos = (canvas_dim-w)//2
+    y_pos = (canvas_dim-h)//2
+
+    return (x, y, w, h, x_pos, y_pos, canvas_dim)
+
+# Canvas pixels in rows y0:y1 and columns x0:x1, white outside the cropped image
+def canvas_region(bw, transform, x0, y0, x1, y1):
+    x, y, w, h, x_pos, y_pos, _ = transform
+
+    region = np.full((y1-y0, x1-x0), 255, dtype=np.uint8)
+
+    cx0 = max(x0, x_pos)
+    cx1 = min(x1, x_pos+w)
+    cy0 = max(y0, y_pos)
+    cy1 = min(y1, y_pos+h)
+
+    if cx0 < cx1 and cy0 < cy1:
+        region[cy0-y0:cy1-y0, cx0-x0:cx1-x0] = bw[cy0-y_pos+y:cy1-y_pos+y, cx0-x_pos+x:cx1-x_pos+x]
+
+    return region
+
+# Edges of the canvas tile with top left corner (x0, y0), in a worker
+# Edges are generated from the pixels of the tile, which are the start of
+# the edge in Graph.make_edges, so every edge of the canvas belongs to one
+# tile. Edges are returned in canvas coordinates, as in Graph.make_edges
+# If min_area is set, components are removed as in Image in the region of
+# the tile with a margin of 2*min_area more pixels. Components smaller than
+# min_area are less than min_area pixels wide, so every component that
+# reaches the tile and is cut by the margin is kept, as in the full canvas
+def trace_tile(task):
+    bw_path, transform, x0, y0, tile_size, t_lower, t_upper, edge_mode, min_area = task
+
+    bw = np.load(bw_path, mmap_mode="r")
+    canvas_dim = transform[6]
+
+    x1 = min(x0+tile_size, canvas_dim)
+    y1 = min(y0+tile_size, canvas_dim)
+
+    m = TILE_MARGIN
+    region = canvas_region(bw, transform, x0-m, y0-m, x1+m, y1+m)
+
+    # Components of black blobs, then white holes, inside the canvas
+    if min_area > 0:
+        a = m + 2*min_area
+        ax0, ay0 = max(x0-a, 0), max(y0-a, 0)
+        ax1, ay1 = min(x1+a, canvas_dim), min(y1+a, canvas_dim)
+
+        area = canvas_region(bw, transform, ax0, ay0, ax1, ay1)
+        area = remove_components(area, 0, min_area)
+        area = remove_components(area, 255, min_area)
+
+        rx0, ry0 = max(x0-m, 0), max(y0-m, 0)
+        rx1, ry1 = min(x1+m, canvas_dim), min(y1+m, canvas_dim)
+        region[ry0-(y0-m):ry1-(y0-m), rx0-(x0-m):rx1-(x0-m)] = area[ry0-ay0:ry1-ay0, rx0-ax0:rx1-ax0]
+
+    if edge_mode[0] == "b":
+        canny = boundary_mask(region).astype(np.uint8)*255
+    else:
+        canny = cv2.Canny(region, t_lower, t_upper)
+
+    # Tile and one pixel around it, for the edges that leave the tile
+    canny = canny[m-1:m+(y1-y0)+1, m-1:m+(x1-x0)+1]
+
+    graph = Graph(None)
+    edges = graph.make_edges(canny)
+
+    start = edges[:,0]
+    in_tile = (start[:,0] >= 1) & (start[:,0] <= x1-x0) & (start[:,1] >= 1) & (start[:,1] <= y1-y0)
+    return edges[in_tile] + np.array([x0-1, y0-1], dtype=np.int32)
+
+# Image traced in tiles, for images that don't fit in memory as a canvas
+# The black-white image is kept in a temporary .npy file, and every tile is
+# read from it when it's traced. The color canvas isn't built, so there is no
+# result image
+class TiledImage(Image):
+
+    def __init__(self, filename, t_lower, t_upper, bw_thresh, tile_size, min_area=0, edge_mode="canny"):
+        self.filename = filename
+        self.t_lower = t_lower
+        self.t_upper = t_upper
+        self.tile_size = tile_size
+        self.min_area = min_area
+        self.edge_mode = edge_mode
+
+        self.band_dir = tempfile.TemporaryDirectory()
+        self.bw = threshold_to_file(filename, bw_thresh, self.band_dir.name)
+        self.transform = canvas_transform(self.bw)
+
+        self.original = None
+        self.canny = None
+        self.graph = None
+        self.workers = 1    # Processes for tiles and per-path stages
+
+    ################
+    # INITIALIZERS #
+    ################
+
+    # Get the edges of every tile and trace paths from all of them
+    # Black-white image file is removed after tracing
+    def make_edges(self):
+        self.set_graph(Graph(self))
+
+        canvas_dim = self.transform[6]
+        bw_path = os.path.join(self.band_dir.name, "bw.npy")
+
+        tasks = []
+        for y0 in range(0, canvas_dim, self.tile_size):
+            for x0 in range(0, canvas_dim, self.tile_size):
+                tasks.append((bw_path, self.transform, x0, y0, self.tile_size, self.t_lower, self.t_upper, self.edge_mode, self.min_area))
+
+        if self.workers > 1:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                results = list(executor.map(trace_tile, tasks))
+        else:
+            results = [trace_tile(task) for task in tasks]
+
+        # Edges of all tiles in the order of Graph.make_edges for the whole
+        # canvas: by start pixel in row-major order, then by direction
+        edges = np.concatenate(results)
+        start = edges[:,0].astype(np.int64)
+        d = edges[:,1] - edges[:,0]
+        direction = np.where(d[:,1] == 0, 0, np.where(d[:,0] == 0, 1, np.where(d[:,0] == 1, 2, 3)))
+        keys = (start[:,1]*canvas_dim + start[:,0])*4 + direction
+
+        # Paths are traced from all edges at once, same as in Image
+        self.get_graph().make_paths(edges[np.argsort(keys)])
+
+        self.bw = None
+        self.band_dir.cleanup()
+
+        return self.get_graph().get_paths()
+
+    ###################
+    #  IMAGE DISPLAY  #
+    ###################
+
+    # There is no color canvas to draw on
+    def draw_edges(self):
+        return None
@@ -0,0 +1,168 @@
+import math
+import numpy as np
+
+# Geometry functions shared by the canny and triangle methods
+# Points are (x,y) tuples or lists, vectors are given by their two points.
+# Scalar functions use plain arithmetic, batched functions take arrays of
+# points or vectors with coordinates in the last axis
+
+######################
+#  SCALAR FUNCTIONS  #
+######################
+
+# Cross product of vectors p1->p2 and q1->q2
+def get_cross(p1,p2,q1,q2):
+    return (p2[0]-p1[0])*(q2[1]-q1[1]) - (p2[1]-p1[1])*(q2[0]-q1[0])
+
+# Dot product of vectors p1->p2 and q1->q2
+def get_dot(p1,p2,q1,q2):
+    return (p2[0]-p1[0])*(q2[0]-q1[0]) + (p2[1]-p1[1])*(q2[1]-q1[1])
+
+# Squared distance between two points
+def dist_squared(p1,p2):
+    return (p2[0]-p1[0])**2 + (p2[1]-p1[1])**2
+
+def dist_two_points(p1,p2):
+    return math.sqrt(dist_squared(p1,p2))
+
+# Distance comparisons without sqrt
+def dist_less(p1,p2,max_dist):
+    return dist_squared(p1,p2) < max_dist*max_dist
+
+def dist_at_most(p1,p2,max_dist):
+    return dist_squared(p1,p2) <= max_dist*max_dist
+
+# Cosine of angle between vectors p1->p2 and q1->q2, clamped to [-1,1]
+# A zero length vector has no direction, the angle is taken as 0
+def get_cos(p1,p2,q1,q2):
+    mv1 = math.sqrt(dist_squared(p1,p2))
+    mv2 = math.sqrt(dist_squared(q1,q2))
+
+    if mv1 == 0 or mv2 == 0:
+        return 1
+
+    a = get_dot(p1,p2,q1,q2)/(mv1*mv2)
+    if a > 1:
+        a = 1
+    if a < -1:
+        a = -1
+
+    return a
+
+# Angle between vectors p1->p2 and q1->q2, in whole degrees from 0 to 180
+def get_angle(p1,p2,q1,q2):
+    return int(math.degrees(math.acos(get_cos(p1,p2,q1,q2))))
+
+# Angle from vector p1->p2 to vector q1->q2, in whole degrees from 0 to 360
+def get_signed_angle(p1,p2,q1,q2):
+    angle = get_angle(p1,p2,q1,q2)
+
+    if get_cross(p1,p2,q1,q2) < 0:
+        return 360 - angle
+    return angle
+
+# Check if angle between vectors is below a limit, comparing cosines
+def angle_below(p1,p2,q1,q2,limit):
+    return get_cos(p1,p2,q1,q2) > math.cos(math.radians(limit))
+
+# Distance from point p to line through a and b, or to a if a and b are equal
+def line_point_dist(p, a, b):
+    line_len = dist_two_points(a,b)
+
+    if line_len == 0:
+        return dist_two_points(a,p)
+
+    return abs(get_cross(a,b,p,a))/line_len
+
+# Slope and intercept of line through v1 and v2, None for vertical lines
+def get_equations(v1, v2):
+    if v1[0] != v2[0]:
+        m = (v1[1]-v2[1])/(v1[0]-v2[0])
+        b = v1[1] - m*v1[0]
+    else:
+        m = None
+        b = None
+    return (m,b)
+
+# x coordinate at height y of line from get_equations, vertex is used for
+# vertical and horizontal lines
+def solve_equations(y, m, b, vertex):
+    if not m:
+        return vertex[0]
+
+    return (y-b)//m
+
+# x coordinate at height y of segment v1,v2
+def get_intersection(v1, v2, y):
+    if v1[0] != v2[0]:
+        m = (v1[1]-v2[1])/(v1[0]-v2[0])
+        b = v1[1] - m*v1[0]
+        return (y-b)//m
+    else:
+        return v1[0]
+
+#######################
+#  BATCHED FUNCTIONS  #
+#######################
+
+# Lengths of vectors
+def norms(v):
+    v = np.asarray(v, dtype=np.int64)
+    return np.sqrt((v**2).sum(axis=-1).astype(np.float64))
+
+# Distances between point arrays
+def point_dists(p, q):
+    return norms(np.asarray(q, dtype=np.int64) - np.asarray(p, dtype=np.int64))
+
+# Cross and dot products of vector arrays
+def cross_products(v1, v2):
+    return v1[...,0]*v2[...,1] - v1[...,1]*v2[...,0]
+
+def dot_products(v1, v2):
+    return v1[...,0]*v2[...,0] + v1[...,1]*v2[...,1]
+
+# Angles between integer vector arrays, in whole degrees from 0 to 180, as
+# get_angle. Returns the angles and a mask of the pairs with no zero vector,
+# angles of other pairs are 0. Values close to an integer are computed again
+# with math.acos, so truncation is the same as in get_angle
+def vector_angles(v1, v2):
+    v1 = np.asarray(v1, dtype=np.int64)
+    v2 = np.asarray(v2, dtype=np.int64)
+
+    len1 = norms(v1)
+    len2 = norms(v2)
+
+    valid = (len1 > 0) & (len2 > 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cos = np.clip(dot_products(v1,v2)/(len1*len2), -1, 1)
+    cos = np.where(valid, cos, 1)
+
+    degrees = np.degrees(np.arccos(cos))
+    angle = degrees.astype(np.int64)
+
+    close = valid & (np.abs(degrees - np.round(degrees)) < 1e-9)
+    for i in zip(*np.nonzero(close)):
+        angle[i] = int(math.degrees(math.acos(cos[i])))
+
+    return angle, valid
+
+# Angles from v1 to v2 from 0 to 360, as get_signed_angle
+def signed_vector_angles(v1, v2):
+    angle, valid = vector_angles(v1, v2)
+    angle = np.where(cross_products(np.asarray(v1, dtype=np.int64), np.asarray(v2, dtype=np.int64)) < 0, 360 - angle, angle)
+    return angle, valid
+
+# Distance from vertices k to lines from vertices s to vertices c
+# x, y are vertex coordinates, index arrays must be broadcastable
+def line_point_dists(x, y, s, c, k):
+    x1, y1 = x[s], y[s]
+    x2, y2 = x[c], y[c]
+    x0, y0 = x[k], y[k]
+
+    line_len = np.sqrt(((x2-x1)**2)+((y2-y1)**2))
+
+    # If line points are the same, use distance to that point
+    point_dist = np.sqrt((x0 - x1)**2 + (y0 - y1)**2)
+    line_dist = np.abs((x2-x1)*(y1-y0) - (x1-x0)*(y2-y1))/np.where(line_len > 0, line_len, 1)
+
+    return np.where(line_len > 0, line_dist, point_dist)
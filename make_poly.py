@@ -1,5 +1,6 @@
 from triangle_method import border_tri as t
 from canny_method import border_canny as c
+from canny_method import border_contour as o
 import argparse
 import ast
 import time
@@ -60,9 +61,13 @@ def make_poly(path_list, name):
 def main(method, image, params, show):
 
     method_id = method[0]
+    if method == "contour":
+        method_id = "o"
 
     if method_id == "c":
         print("\nMétodo de detección de bordes a utilizar: Canny\n")
+    elif method_id == "o":
+        print("\nMétodo de detección de bordes a utilizar: Contornos\n")
     else:
         print("\nMétodo de detección de bordes a utilizar: Triangulación\n")
 
@@ -74,7 +79,21 @@ def main(method, image, params, show):
             max_dist = params[2]
             fuse_dist = params[3]
             bw_thresh = params[4]
-            paths, result = c.main(image, reduction, r_params, max_dist, fuse_dist, bw_thresh)
+            frag_params = params[5]
+            min_area = params[6]
+            edge_mode = params[7]
+            workers = params[8]
+            tile_size = params[9]
+            paths, result = c.main(image, reduction, r_params, max_dist, fuse_dist, bw_thresh, frag_params, min_area, edge_mode, workers, tile_size)
+
+        case "o":
+            reduction = params[0]
+            r_params = params[1]
+            fuse_dist = params[3]
+            bw_thresh = params[4]
+            min_area = params[6]
+            workers = params[8]
+            paths, result = o.main(image, reduction, r_params, fuse_dist, bw_thresh, min_area, workers)
         
         case "t":
             triangle_dim = params[0]
@@ -84,8 +103,10 @@ def main(method, image, params, show):
             verbose = params[4]
             timelapse = params[5]
             lapse_img = params[6]
+            engine = params[7]
+            workers = params[8]
             
-            paths, result = t.main(image, triangle_dim, iterations,bw_thresh, min_e_len, verbose, timelapse, lapse_img)
+            paths, result = t.main(image, triangle_dim, iterations,bw_thresh, min_e_len, verbose, timelapse, lapse_img, engine, workers)
 
     name = image.split(".")[-2]
 
@@ -104,7 +125,12 @@ canny_params = [
     [20,1], # Reduction parameters
     15, # Maximum reduction distance
     5, # Maximum fuse distance
-    254  # Black-white threshold
+    254, # Black-white threshold
+    [0,0], # Fragment filter (minimum length and bounding box size)
+    0, # Minimum blob and hole area
+    "canny", # Edge detection mode
+    1, # Worker processes
+    0 # Tile size
     ]
 
 triangle_params = [
@@ -114,7 +140,9 @@ triangle_params = [
     3, # Minimum edge length
     False, # Verbose
     False, # Timelapse
-    "color" # Image for timelapse
+    "color", # Image for timelapse
+    "objects", # Mesh engine
+    1 # Worker processes for vertex movement
     ]
 
 used_method = "canny"
@@ -125,79 +153,107 @@ parser.add_argument("filename")       # Filename
 parser.add_argument("--method")     # Method used
 parser.add_argument("--thresh")     # Thresholding function value
 
-parser.add_argument("--reduction")  # Reduction method (fixed, variable, mixed)
+parser.add_argument("--reduction")  # Reduction method (fixed, variable, mixed, dp)
 parser.add_argument("--len")        # Edge length (for fixed and mixed)
-parser.add_argument("--maxdist")    # Maximum distance (for variable and mixed)
+parser.add_argument("--maxdist")    # Maximum distance (for variable, mixed and dp)
 parser.add_argument("--fusedist")   # Maximum distance (for variable and mixed)
 parser.add_argument("--pathdist")   # Maximum distance for path fusion
+parser.add_argument("--fraglen")    # Minimum length of isolated paths
+parser.add_argument("--fragsize")   # Minimum bounding box size of isolated paths
+parser.add_argument("--minarea")    # Minimum area of blobs and holes
+parser.add_argument("--edges")      # Edge detection mode (canny, boundary)
+parser.add_argument("--workers")    # Worker processes for per-path stages and vertex movement
+parser.add_argument("--tile")       # Tile size for tiled tracing
 
 parser.add_argument("--x")          # Horizontal triangle number
 parser.add_argument("--y")          # Vertical triangle number
 parser.add_argument("--xy")         # Dimension as tuple or single number
 parser.add_argument("--it")         # Number of iterations (for triangle)
 parser.add_argument("--minlen")     # Minimun edge length
+parser.add_argument("--engine")     # Mesh engine (objects, arrays)
 
 parser.add_argument("--verbose", action='store_true')    # Show log
 parser.add_argument("--timelapse", action='store_true')  # Generate .gif with timelapse
 parser.add_argument("--show", action='store_true')       # Show resulting image
 
-args = parser.parse_args()
+if __name__ == "__main__":
+    args = parser.parse_args()
 
-if not args.filename:
-    print("Please input a file")
+    if not args.filename:
+        print("Please input a file")
 
-else:
+    else:
 
-    if args.reduction:
-        if args.reduction[0] in ["f","v","h"]:
-            canny_params[0] = args.reduction
+        if args.reduction:
+            if args.reduction[0] in ["f","v","h","d"]:
+                canny_params[0] = args.reduction
 
-    if args.thresh:
-        canny_params[4] = int(args.thresh)
-        triangle_params[2] = int(args.thresh)
+        if args.thresh:
+            canny_params[4] = int(args.thresh)
+            triangle_params[2] = int(args.thresh)
     
-    if args.len:
-        canny_params[1][0] = int(args.len)
-    if args.maxdist:
-        canny_params[1][1] = float(args.maxdist)
-    if args.fusedist:
-        canny_params[3] = int(args.fusedist)
-    if args.pathdist:
-        canny_params[2] = int(args.pathdist)
+        if args.len:
+            canny_params[1][0] = int(args.len)
+        if args.maxdist:
+            canny_params[1][1] = float(args.maxdist)
+        if args.fusedist:
+            canny_params[3] = int(args.fusedist)
+        if args.pathdist:
+            canny_params[2] = int(args.pathdist)
+        if args.fraglen:
+            canny_params[5][0] = int(args.fraglen)
+        if args.fragsize:
+            canny_params[5][1] = int(args.fragsize)
+        if args.minarea:
+            canny_params[6] = int(args.minarea)
+        if args.edges:
+            if args.edges[0] in ["c","b"]:
+                canny_params[7] = args.edges
+        if args.workers:
+            canny_params[8] = int(args.workers)
+            triangle_params[8] = int(args.workers)
+        if args.tile:
+            canny_params[9] = int(args.tile)
     
-    if canny_params[0][0] != "h":
-        if canny_params[0][0] == "f":
-            canny_params[1].pop(1)
-        if canny_params[0][0] == "v":
-            canny_params[1].pop(0)
-
-    if args.x:
-        triangle_params[0][0] = int(args.x)
-    if args.y:
-        triangle_params[0][1] = int(args.y)
-    if args.xy:
-        value = ast.literal_eval(args.xy)
-        if isinstance(value, tuple):
-            triangle_params[0][0] = value[0]
-            triangle_params[0][1] = value[1]
-        elif isinstance(value, int):
-            triangle_params[0][0] = value
-            triangle_params[0][1] = value
-
-    if args.it:
-        triangle_params[1] = int(args.it)
-
-    if args.minlen:
-        triangle_params[3] = int(args.minlen)
-
-    if args.verbose:
-        triangle_params[4] = bool(args.verbose)
-    if args.timelapse:
-        triangle_params[5] = bool(args.timelapse)
-
-    if args.method:
-        if args.method[0] == "t":
-            used_method = "triangle"
-            used_params = triangle_params
-
-    main(used_method, args.filename, used_params, args.show)
+        if canny_params[0][0] != "h":
+            if canny_params[0][0] == "f":
+                canny_params[1].pop(1)
+            if canny_params[0][0] in ["v","d"]:
+                canny_params[1].pop(0)
+
+        if args.x:
+            triangle_params[0][0] = int(args.x)
+        if args.y:
+            triangle_params[0][1] = int(args.y)
+        if args.xy:
+            value = ast.literal_eval(args.xy)
+            if isinstance(value, tuple):
+                triangle_params[0][0] = value[0]
+                triangle_params[0][1] = value[1]
+            elif isinstance(value, int):
+                triangle_params[0][0] = value
+                triangle_params[0][1] = value
+
+        if args.it:
+            triangle_params[1] = int(args.it)
+
+        if args.minlen:
+            triangle_params[3] = int(args.minlen)
+
+        if args.engine:
+            if args.engine[0] in ["o","a"]:
+                triangle_params[7] = args.engine
+
+        if args.verbose:
+            triangle_params[4] = bool(args.verbose)
+        if args.timelapse:
+            triangle_params[5] = bool(args.timelapse)
+
+        if args.method:
+            if args.method in ["contour", "o"]:
+                used_method = "contour"
+            elif args.method[0] == "t":
+                used_method = "triangle"
+                used_params = triangle_params
+
+        main(used_method, args.filename, used_params, args.show)
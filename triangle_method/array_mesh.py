@@ -0,0 +1,1728 @@
+import cv2
+from .triangle import *
+
+# Allowed movement directions for each value of the movement flags, 1 is
+# horizontal and 2 is vertical movement, in the same order as Vertex.movement
+MOVEMENTS = [[], [(1,0),(-1,0)], [(0,1),(0,-1)], [(1,0),(-1,0),(0,1),(0,-1)]]
+DIAGONALS = [(1,1),(1,-1),(-1,1),(-1,-1)]
+
+# Candidate directions for each value of the movement flags, plus 4 when
+# diagonal movement is tried, as arrays padded to the same length
+CANDIDATES = [MOVEMENTS[c % 4] + (DIAGONALS if c >= 4 else []) for c in range(8)]
+CANDIDATE_COUNTS = np.array([len(c) for c in CANDIDATES])
+CANDIDATE_TABLE = np.zeros((8, 8, 2), dtype=np.int64)
+for c in range(8):
+    CANDIDATE_TABLE[c,:len(CANDIDATES[c])] = np.reshape(CANDIDATES[c], (-1,2))
+
+# Arrays for each element kind: name, columns, type, initial value and kind
+# of the elements referenced by the values
+FIELDS = {
+    "v": [
+        ("v_pos", 2, np.int64, 0, None),        # Position (x,y)
+        ("v_err", 1, np.float64, np.nan, None), # Approximation error, nan if not set
+        ("v_move", 1, np.uint8, 0, None),       # Movement flags
+        ("v_dir", 2, np.int64, 0, None),        # Direction of next movement
+        ("v_has_dir", 1, bool, False, None),    # True if direction was calculated
+        ("v_first", 1, np.int32, -1, "e"),      # First edge with vertex as start
+        ("v_last", 1, np.int32, -1, "e"),       # Last edge with vertex as start
+        ("v_dirty", 1, bool, True, None),       # Dirty flag, as in Vertex
+        ("v_alive", 1, bool, False, None),      # False if removed from mesh
+    ],
+    "e": [
+        ("e_start", 1, np.int32, -1, "v"),      # Start vertex
+        ("e_end", 1, np.int32, -1, "v"),        # End vertex
+        ("e_twin", 1, np.int32, -1, "e"),       # Opposite edge
+        ("e_prev", 1, np.int32, -1, "e"),       # Previous edge
+        ("e_next", 1, np.int32, -1, "e"),       # Next edge
+        ("e_vprev", 1, np.int32, -1, "e"),      # Previous edge with same start
+        ("e_vnext", 1, np.int32, -1, "e"),      # Next edge with same start
+        ("e_face", 1, np.int32, -1, "f"),       # Associated triangle
+        ("e_border", 1, bool, False, None),     # Border flag
+        ("e_alive", 1, bool, False, None),
+    ],
+    "f": [
+        ("f_edges", 3, np.int32, -1, "e"),      # Edges that define triangle
+        ("f_avg", 1, np.float64, np.nan, None), # Average color, nan if not set
+        ("f_err", 1, np.float64, np.nan, None), # Approximation error, nan if not set
+        ("f_new", 1, bool, True, None),         # New triangle flag, as in Triangle
+        ("f_dirty", 1, bool, True, None),       # Dirty flag, as in Triangle
+        ("f_alive", 1, bool, False, None),
+    ],
+}
+
+MIN_CAPACITY = 1024
+
+# Elements checked at once in refinement loops
+BLOCK = 4096
+
+# Triangles rasterized at once
+FACE_BATCH = 1 << 16
+
+# Vertices whose movement is tested at once, in one process and in a pool
+VERTEX_BATCH = 1024
+POOL_BATCH = 1 << 16
+
+# Index of an element that must exist, where Mesh would use a None reference
+def need(i):
+    if i < 0:
+        raise AttributeError("Missing mesh element")
+    return i
+
+# Position in the list of elements of a kind, for loops by index as in Mesh
+# Removal of elements before the current one shifts its position, as in a list
+class Cursor:
+    def __init__(self, mesh, kind):
+        self.mesh = mesh
+        self.kind = kind
+        self.i = 0          # Position of current element
+        self.s = -1         # Slot of current element, -1 before first access
+        self.gone = False   # True if current element was removed
+
+    def __enter__(self):
+        self.mesh.cursors.append(self)
+        return self
+
+    def __exit__(self, *args):
+        self.mesh.cursors.remove(self)
+
+    # Get slot of element at position i
+    def get(self, i):
+        if self.s < 0 or i < self.i:
+            s = self.mesh.nth_slot(self.kind, 0, i)
+        else:
+            s = self.s
+            if self.gone:
+                s = self.mesh.nth_slot(self.kind, s+1, 0)
+            if i > self.i:
+                s = self.mesh.nth_slot(self.kind, s+1, i-self.i-1)
+
+        self.i = i
+        self.s = s
+        self.gone = False
+        return s
+
+    # Element in slot s was removed
+    def removed(self, s):
+        if s < self.s:
+            self.i -= 1
+        elif s == self.s:
+            self.gone = True
+
+# Triangle mesh stored as arrays of vertices, half-edges and triangles, with
+# the same operations as Mesh. Elements are slots in the arrays, removed
+# elements keep their slot until compaction so slot order is list order, and
+# results are the same as with Mesh. Memory per element is a few bytes
+# instead of a Python object, for meshes of millions of triangles
+class ArrayMesh:
+    def __init__(self, image, min_e_len):
+
+        self.image = image # Associated Image object
+        self.min_e_len = min_e_len # Minimum edge length for mesh
+
+        self.n = {"v": 0, "e": 0, "f": 0}      # Used slots
+        self.size = {"v": 0, "e": 0, "f": 0}   # Elements in mesh
+
+        for kind in FIELDS:
+            self.grow(kind, MIN_CAPACITY)
+
+        self.cursors = []   # Open cursors, updated on removal
+        self.version = 0    # Changes every time the mesh is modified
+
+        self.t_area = None # Initial triangle area
+
+        # Vertices whose movement was tested without moving them, with their
+        # last candidate direction, as Mesh
+        self.pending_tests = []
+
+    ###############
+    #   GETTERS   #
+    ###############
+
+    # Slots of elements, in list order
+    def get_vertices(self):
+        return self.slots("v")
+
+    def get_edges(self):
+        return self.slots("e")
+
+    def get_triangles(self):
+        return self.slots("f")
+
+    def get_t_area(self):
+        return self.t_area
+
+    def get_min_e_len(self):
+        return self.min_e_len
+
+    def slots(self, kind, start=0):
+        alive = getattr(self, kind + "_alive")
+        return np.flatnonzero(alive[start:self.n[kind]]) + start
+
+    # Slot of the k-th element from slot start
+    def nth_slot(self, kind, start, k):
+        alive = getattr(self, kind + "_alive")
+        n = self.n[kind]
+
+        s = start
+        end = min(n, start+k+64)
+        while s < end:
+            if alive[s]:
+                if k == 0:
+                    return s
+                k -= 1
+            s += 1
+
+        slots = np.flatnonzero(alive[s:n])
+        if k >= len(slots):
+            raise IndexError("Mesh element position out of range")
+        return s + slots[k]
+
+    # Slots of up to count elements from slot start
+    def next_slots(self, kind, start, count):
+        alive = getattr(self, kind + "_alive")
+        n = self.n[kind]
+
+        width = 2*count + 64
+        while True:
+            slots = np.flatnonzero(alive[start:start+width]) + start
+            if len(slots) >= count or start+width >= n:
+                return slots[:count]
+            width *= 2
+
+    # Vertex position as tuple
+    def pos(self, v):
+        return tuple(self.v_pos[v].tolist())
+
+    ###############
+    #   SETTERS   #
+    ###############
+
+    def set_t_area(self, val):
+        self.t_area = val
+
+    # Resize arrays of an element kind
+    def grow(self, kind, capacity):
+        n = self.n[kind]
+        for name, cols, dtype, fill, ref in FIELDS[kind]:
+            shape = (capacity,) if cols == 1 else (capacity, cols)
+            new = np.full(shape, fill, dtype=dtype)
+            if hasattr(self, name):
+                new[:n] = getattr(self, name)[:n]
+            setattr(self, name, new)
+
+    # Get slot for a new element
+    def alloc(self, kind):
+        s = self.n[kind]
+        alive = getattr(self, kind + "_alive")
+        if s == len(alive):
+            self.grow(kind, 2*s)
+            alive = getattr(self, kind + "_alive")
+
+        alive[s] = True
+        self.n[kind] += 1
+        self.size[kind] += 1
+        self.version += 1
+        return s
+
+    # Mark element in slot s as removed
+    def release(self, kind, s, name):
+        alive = getattr(self, kind + "_alive")
+        if not alive[s]:
+            print("ERROR: Can't remove " + name + " not in mesh " + name + " list")
+            return
+
+        alive[s] = False
+        self.size[kind] -= 1
+        self.version += 1
+
+        for cursor in self.cursors:
+            if cursor.kind == kind:
+                cursor.removed(s)
+
+    def remove_vertex(self, v):
+        self.release("v", v, "vertex")
+
+    def remove_triangle(self, f):
+        self.release("f", f, "triangle")
+
+    # Remove edge from mesh and delete references to it, as Edge.remove
+    def remove_edge(self, e):
+        self.vert_remove_edge(self.e_start[e], e)
+
+        p = self.e_prev[e]
+        if p >= 0:
+            self.e_next[p] = -1
+        n = self.e_next[e]
+        if n >= 0:
+            self.e_prev[n] = -1
+        t = self.e_twin[e]
+        if t >= 0:
+            self.e_twin[t] = -1
+
+        self.release("e", e, "edge")
+
+    # Remove empty slots, list order doesn't change
+    # References to removed elements are set to None
+    def compact(self):
+        keep = {}
+        index = {}
+        for kind in FIELDS:
+            keep[kind] = self.slots(kind)
+
+            # Last value maps -1 to -1
+            index[kind] = np.full(self.n[kind]+1, -1, dtype=np.int64)
+            index[kind][keep[kind]] = np.arange(len(keep[kind]))
+
+        for kind in FIELDS:
+            size = len(keep[kind])
+            capacity = max(MIN_CAPACITY, 2*size)
+
+            for name, cols, dtype, fill, ref in FIELDS[kind]:
+                values = getattr(self, name)[keep[kind]]
+                if ref:
+                    values = index[ref][values]
+
+                shape = (capacity,) if cols == 1 else (capacity, cols)
+                new = np.full(shape, fill, dtype=dtype)
+                new[:size] = values
+                setattr(self, name, new)
+
+            self.n[kind] = size
+
+        self.version += 1
+
+    ###############
+    #    MAKERS   #
+    ###############
+
+    def make_vertex(self, x_pos, y_pos):
+        v = self.alloc("v")
+        self.v_pos[v] = (x_pos, y_pos)
+        return v
+
+    # Makes new edge, twin is first edge from end_v to start_v
+    def make_edge(self, start_v, end_v):
+        e = self.alloc("e")
+        self.e_start[e] = start_v
+        self.e_end[e] = end_v
+
+        self.vert_add_edge(start_v, e)
+
+        opp_e = self.vert_opposite(end_v, start_v)
+        if opp_e >= 0:
+            self.e_twin[e] = opp_e
+            self.e_twin[opp_e] = e
+
+        return e
+
+    def make_triangle(self, edge_list):
+        f = self.alloc("f")
+        self.f_edges[f] = edge_list
+
+        for i in range(3):
+            e = edge_list[i]
+            self.e_face[e] = f
+            self.v_dirty[self.e_start[e]] = True
+            self.e_prev[e] = edge_list[(i+2)%3]
+            self.e_next[e] = edge_list[(i+1)%3]
+
+        return f
+
+    # Makes edges and triangle from 3 vertices
+    def connect_3(self, v_list):
+        e_list = [self.make_edge(v_list[i], v_list[(i+1)%3]) for i in range(3)]
+        return self.make_triangle(e_list)
+
+    #################
+    #  INITIALIZERS #
+    #################
+
+    # Same mesh as Mesh.make, edges and triangles are created at once
+    def make(self, img_h, img_v, h_tri, v_tri, same=False):
+
+        # Size in pixels for each triangle
+        step_h = (img_h-1)/h_tri
+        step_v = (img_v-1)/v_tri
+
+        self.set_t_area(step_h*step_v)
+
+        # Create vertices
+        grid = np.zeros((v_tri+1, h_tri+1), dtype=np.int64)
+        for j in range(v_tri+1):
+            for i in range(h_tri+1):
+                grid[j,i] = self.make_vertex(round(i*step_h),round(j*step_v))
+
+        # Setting allowed movement directions
+        h_mov = np.ones(h_tri+1, dtype=np.uint8)
+        h_mov[[0,-1]] = 0
+        v_mov = np.ones(v_tri+1, dtype=np.uint8)*2
+        v_mov[[0,-1]] = 0
+        self.v_move[grid] = h_mov[None,:] | v_mov[:,None]
+
+        # a b
+        # c d
+        a = grid[:-1,:-1].ravel()
+        b = grid[:-1,1:].ravel()
+        c = grid[1:,:-1].ravel()
+        d = grid[1:,1:].ravel()
+
+        # Errors of both connections, [/] acb, bcd and [\] acd, adb
+        options = np.stack((np.stack((a,c,b),1), np.stack((b,c,d),1), np.stack((a,c,d),1), np.stack((a,d,b),1)), 1)
+        err = self.triangle_errs(options.reshape(-1,3)).reshape(-1,4)
+        if np.isnan(err).any():
+            raise TypeError("Triangle with no points in initial mesh")
+
+        flip_false = err[:,0] + err[:,1]
+        flip_true = err[:,2] + err[:,3]
+
+        flip = (flip_true < flip_false) | same
+        tri = np.where(flip[:,None,None], options[:,2:], options[:,:2]).reshape(-1,3)
+
+        # Edges of every triangle in order, as made by connect_3
+        t_count = len(tri)
+        e_count = 3*t_count
+        self.grow("e", max(MIN_CAPACITY, 2*e_count))
+        self.grow("f", max(MIN_CAPACITY, 2*t_count))
+
+        faces = np.arange(t_count)
+        edges = np.arange(e_count).reshape(-1,3)
+
+        self.f_edges[:t_count] = edges
+        self.f_alive[:t_count] = True
+        self.e_start[:e_count] = tri.ravel()
+        self.e_end[:e_count] = np.roll(tri, -1, axis=1).ravel()
+        self.e_next[:e_count] = np.roll(edges, -1, axis=1).ravel()
+        self.e_prev[:e_count] = np.roll(edges, 1, axis=1).ravel()
+        self.e_face[:e_count] = np.repeat(faces, 3)
+        self.e_alive[:e_count] = True
+
+        # Twin of every edge, each pair of vertices has at most one edge
+        n_v = self.n["v"]
+        keys = self.e_start[:e_count].astype(np.int64)*n_v + self.e_end[:e_count]
+        opp_keys = self.e_end[:e_count].astype(np.int64)*n_v + self.e_start[:e_count]
+        order = np.argsort(keys)
+        found = np.minimum(np.searchsorted(keys[order], opp_keys), e_count-1)
+        has_twin = keys[order][found] == opp_keys
+        self.e_twin[:e_count] = np.where(has_twin, order[found], -1)
+
+        # Edge lists of vertices in order of creation
+        order = np.argsort(self.e_start[:e_count], kind="stable")
+        starts = self.e_start[order]
+        same_start = starts[1:] == starts[:-1]
+        self.e_vnext[order[:-1]] = np.where(same_start, order[1:], -1)
+        self.e_vprev[order[1:]] = np.where(same_start, order[:-1], -1)
+        first = np.concatenate(([True], ~same_start))
+        last = np.concatenate((~same_start, [True]))
+        self.v_first[starts[first]] = order[first]
+        self.v_last[starts[last]] = order[last]
+
+        self.n["e"] = self.size["e"] = e_count
+        self.n["f"] = self.size["f"] = t_count
+        self.version += 1
+
+    ################
+    #   UPDATERS   #
+    ################
+
+    # Average color and number of points of triangles with given vertices
+    def triangle_values(self, tri):
+        avg = np.zeros(len(tri))
+        l = np.zeros(len(tri), dtype=np.int64)
+
+        for i in range(0, len(tri), FACE_BATCH):
+            points = self.v_pos[tri[i:i+FACE_BATCH]]
+            spans, counts = scanline_spans(points)
+            avg[i:i+FACE_BATCH], l[i:i+FACE_BATCH] = spans_avg(spans, counts, self.image.row_sums)
+
+        return avg, l
+
+    # Approximation error of triangles with given vertices, nan if no points
+    def triangle_errs(self, tri):
+        avg, l = self.triangle_values(tri)
+        return np.where(avg > 127, 255 - avg, avg)
+
+    # Set average and error of triangles, as Triangle.update_err
+    def set_triangle_values(self, faces, avg):
+        self.f_dirty[faces] = False
+        self.f_avg[faces] = avg
+        self.f_err[faces] = np.where(avg > 127, 255 - avg, avg)
+        self.v_dirty[self.e_start[self.f_edges[faces]]] = True
+        self.f_new[faces] = False
+
+    # Update approximation error for every dirty triangle, as Mesh
+    # Errors are calculated at once, triangles with no points collapse
+    # an edge and triangles after them are updated in list order
+    def update_triangles(self):
+
+        # Empty slots are removed between refinement steps
+        for kind in FIELDS:
+            if self.n[kind] > MIN_CAPACITY and self.size[kind] < self.n[kind]//2:
+                self.compact()
+                break
+
+        faces = self.slots("f")
+        faces = faces[self.f_dirty[faces]]
+        tri = self.e_start[self.f_edges[faces]]
+        avg, l = self.triangle_values(tri)
+
+        empty = np.flatnonzero(l == 0)
+        if len(empty) == 0:
+            self.set_triangle_values(faces, avg)
+            return
+
+        first = empty[0]
+        self.set_triangle_values(faces[:first], avg[:first])
+
+        # Remaining triangles from position of first triangle with no points
+        done = np.zeros(self.n["f"], dtype=bool)
+        values = np.zeros(self.n["f"])
+        done[faces[first:]] = l[first:] > 0
+        values[faces[first:]] = avg[first:]
+
+        def visit(f):
+            if f < len(done) and done[f]:
+                self.set_triangle_values(f, values[f])
+            else:
+                self.tri_update_err(f)
+            return (False, 0)
+
+        start = np.count_nonzero(self.f_alive[:faces[first]])
+        self.scan("f", lambda slots: self.f_dirty[slots], visit, start, False)
+
+    # Update approximation error for every dirty vertex
+    def update_vertices(self):
+        n = self.n["v"]
+        dirty = self.v_alive[:n] & self.v_dirty[:n]
+
+        edges = self.slots("e")
+        edges = edges[dirty[self.e_start[edges]]]
+        faces = self.e_face[edges]
+        if (faces < 0).any():
+            raise AttributeError("Edge without triangle")
+
+        errs = self.f_err[faces]
+        if np.isnan(errs).any():
+            raise TypeError("Triangle error not set")
+
+        # Sums of whole numbers, same as in Vertex.update_err
+        sums = np.bincount(self.e_start[edges], weights=errs//3, minlength=n)
+
+        self.v_err[:n] = np.where(dirty, sums, self.v_err[:n])
+        self.v_dirty[:n] &= ~dirty
+
+    # Approximation error of every candidate direction of vertices vs,
+    # as Vertex.test_mov_dirs. For each vertex returns an empty list if it
+    # can't move, None if a triangle is left without points or a list of
+    # (error, direction) tuples. Errors are calculated by pool if given
+    def test_mov_dirs(self, vs, pool=None):
+        vs = np.asarray(vs, dtype=np.int64)
+        tests = [[] for v in vs]
+
+        errs = self.v_err[vs]
+        errs = np.where(np.isnan(errs), 0, errs)
+        flags = self.v_move[vs].astype(np.int64)
+
+        # Try diagonal movement for vertices with high error
+        codes = flags + 4*((errs > 50) & (flags == 3))
+        owners = np.flatnonzero((flags > 0) & (errs != 0))
+
+        if len(owners) == 0:
+            return tests
+
+        centers = vs[owners]
+        codes = codes[owners]
+
+        # Adjacent triangles of each vertex, in edge list order
+        owner = []
+        faces = []
+        idx = np.arange(len(centers))
+        e = self.v_first[centers]
+        while len(e) > 0:
+            live = e >= 0
+            idx, e = idx[live], e[live]
+            owner.append(idx)
+            faces.append(self.e_face[e])
+            e = self.e_vnext[e]
+
+        owner = np.concatenate(owner)
+        order = np.argsort(owner, kind="stable")
+        faces = np.concatenate(faces)[order]
+        if (faces < 0).any():
+            raise AttributeError("Missing mesh element")
+
+        n_faces = np.bincount(owner, minlength=len(centers))
+        n_movs = CANDIDATE_COUNTS[codes]
+        local = np.arange(n_movs.sum()) - np.repeat(np.cumsum(n_movs) - n_movs, n_movs)
+        offsets = CANDIDATE_TABLE[np.repeat(codes, n_movs), local]
+
+        tri = self.e_start[self.f_edges[faces]]
+        is_self = tri == np.repeat(centers, n_faces)[:,None]
+        tri = self.v_pos[tri]
+
+        if pool is None:
+            t_errs, empty = star_errs(tri, is_self, n_faces, offsets, n_movs, self.image.row_sums)
+        else:
+            t_errs, empty = pool.star_errs(tri, is_self, n_faces, offsets, n_movs)
+
+        t_errs = t_errs.tolist()
+        j = 0
+        for i in range(len(owners)):
+            movs = CANDIDATES[codes[i]]
+            if empty[i]:
+                tests[owners[i]] = None
+            else:
+                tests[owners[i]] = [(t_errs[j+m], movs[m]) for m in range(len(movs))]
+            j += len(movs)
+
+        return tests
+
+    # For every vertex, the movement direction is calculated again
+    # and then the vertices are moved in that direction, as Mesh
+    def move_vertices(self, step=1, verbose=None, pool=None):
+
+        total_v = self.size["v"]
+        counter = 1
+
+        # Movement errors in worker processes if pool is given
+        batch = VERTEX_BATCH if pool is None else POOL_BATCH
+        self.pending_tests = []
+
+        with Cursor(self, "v") as cursor:
+            i = 0
+            while i < self.size["v"]:
+                vs = self.next_slots("v", cursor.get(i), batch)
+                tests = self.test_mov_dirs(vs, pool)
+
+                for k in range(len(vs)):
+                    if verbose:
+                        s = "[" + str(counter) + "/" + str(total_v) + "] " + verbose
+                        print(s)
+                        counter += 1
+
+                    # Sequential test modifies the mesh, next vertices are
+                    # tested again
+                    self.vert_update_mov_dir(vs[k], tests[k])
+                    if tests[k] is None:
+                        break
+
+                i += k+1
+
+        self.pending_tests = []
+        vertices = self.slots("v")
+        if not self.v_has_dir[vertices].all():
+            raise TypeError("Vertex without movement direction")
+
+        moving = vertices[(self.v_dir[vertices] != 0).any(axis=1)]
+        self.v_pos[moving] += self.v_dir[moving]*step
+
+        edges = self.slots("e")
+        faces = self.e_face[edges[np.isin(self.e_start[edges], moving)]]
+        self.f_dirty[faces[faces >= 0]] = True
+        self.version += 1
+
+    # Move vertices sequentially, sorted by approximation error as in Mesh
+    # Consecutive vertices are tested at once while none of them is in the
+    # triangles of a later one, so earlier moves don't change later tests
+    def move_vertices_seq(self, step=1, verbose=None):
+
+        vertices = self.slots("v")
+        errs = self.v_err[vertices]
+        errs = np.where(np.isnan(errs), 0, errs)
+        sorted_v = vertices[np.argsort(errs, kind="stable")].tolist()
+
+        total_v = len(vertices)
+        counter = 1
+        self.pending_tests = []
+
+        i = 0
+        while i < len(sorted_v):
+
+            batch = []
+            used = set()
+            while i+len(batch) < len(sorted_v) and len(batch) < VERTEX_BATCH:
+                v = sorted_v[i+len(batch)]
+                if len(batch) > 0 and not used.isdisjoint(self.vert_ring(v)):
+                    break
+                batch.append(v)
+                used.add(v)
+
+            tests = self.test_mov_dirs(batch)
+
+            for k in range(len(batch)):
+                v = batch[k]
+                if verbose:
+                    s = "[" + str(counter) + "/" + str(total_v) + "] " + verbose
+                    print(s)
+                    counter += 1
+
+                self.vert_update_mov_dir(v, tests[k])
+                if tuple(self.v_dir[v]) != (0,0):
+                    self.replay_tests()
+                    x,y = self.v_dir[v].tolist()
+                    self.vert_move(v, (x*step,y*step))
+
+                i += 1
+                if tests[k] is None:
+                    break
+
+        self.pending_tests = []
+
+    # Test the last candidate direction of every pending vertex again, as Mesh
+    def replay_tests(self):
+        for v, mov in self.pending_tests:
+            self.vert_test_mov_dir(v, mov, self.vert_triangles(v))
+        self.pending_tests = []
+
+    ################
+    #  REFINEMENT  #
+    ################
+
+    # Loop by position over elements of a kind, as the loops of Mesh
+    # visit(s) returns (stay, removed), stay keeps the position and removed
+    # is subtracted from the loop length. Elements for which candidates(slots)
+    # is False would only advance the position, they are skipped at once
+    # If fixed is False the loop goes on to the end of the list, as a for loop
+    def scan(self, kind, candidates, visit, start=0, fixed=True):
+        length = self.size[kind]
+        i = start
+
+        with Cursor(self, kind) as cursor:
+            while i < (length if fixed else self.size[kind]):
+                block_i = i
+                count = (length if fixed else self.size[kind]) - i
+                block = self.next_slots(kind, cursor.get(i), min(BLOCK, count))
+                hits = np.flatnonzero(candidates(block))
+                version = self.version
+                i += len(block)
+
+                for h in hits:
+                    stay, removed = visit(cursor.get(block_i+h))
+                    length -= removed
+
+                    # Mesh changed, next elements are checked again
+                    if self.version != version:
+                        i = block_i + h + (0 if stay else 1)
+                        break
+
+    # Opposite angles of edges, as Edge.get_opp_angle
+    # Also returns mask of edges where the angle can be calculated
+    def opp_angles(self, edges):
+        nxt = self.e_next[edges]
+        v = self.v_pos[self.e_end[nxt]]
+        a = self.v_pos[self.e_start[edges]]
+        b = self.v_pos[self.e_end[edges]]
+        angle, valid = vector_angles(a-v, b-v)
+        return angle, valid & (nxt >= 0)
+
+    # Adjacent angles of edges, as Edge.get_adj_angle
+    # Also returns mask of edges where the angle can be calculated
+    def adj_angles(self, edges):
+        twin = self.e_twin[edges]
+        tn = self.e_next[twin]
+        prev = self.e_prev[edges]
+
+        v = self.v_pos[self.e_start[edges]]
+        a = self.v_pos[self.e_end[tn]]
+        b = self.v_pos[self.e_start[prev]]
+
+        angle, valid = vector_angles(a-v, b-v)
+        cross = cross_products(v-b, a-v)
+        angle = np.where(cross < 0, angle, 360-angle)
+
+        valid = valid & (tn >= 0) & (prev >= 0)
+        return np.where(twin >= 0, angle, 0), valid | (twin < 0)
+
+    # Edge flip for mesh structure, as Mesh.edge_flip
+    def edge_flip(self, verbose=False):
+        flips = 0
+
+        def candidates(edges):
+            twin = self.e_twin[edges]
+            angle, valid = self.opp_angles(edges)
+            t_angle, t_valid = self.opp_angles(twin)
+            return (twin >= 0) & ((angle + t_angle > 240) | ~valid | ~t_valid)
+
+        def visit(e):
+            nonlocal flips
+            angle = self.he_opp_angle_sum(e)
+            if angle:
+                if angle > 240:
+                    if self.he_edge_flip(e):
+                        flips += 1
+                        return (True, 6)
+            return (False, 0)
+
+        self.scan("e", candidates, visit)
+
+        if verbose:
+            print("Edge-flips realizados: " + str(flips))
+
+        return flips
+
+    # Edge flip for image approximation, as Mesh.edge_flip_g
+    def edge_flip_g(self, verbose=False):
+        flips = 0
+
+        def candidates(edges):
+            twin = self.e_twin[edges]
+            angle, valid = self.adj_angles(edges)
+            t_angle, t_valid = self.adj_angles(twin)
+            invalid = (twin >= 0) & (~valid | ~t_valid)
+            check = (twin >= 0) & valid & t_valid & (angle < 135) & (t_angle < 135)
+
+            # Flip only if it reduces the error, with the edge as shared edge
+            e = edges[check]
+            t = twin[check]
+            f = self.e_face[e]
+            g = self.e_face[t]
+
+            # Other shared edges are checked one by one
+            shared = np.zeros(len(e), dtype=np.int64)
+            for k in range(3):
+                f_twin = self.e_twin[self.f_edges[f,k]]
+                shared += ((f_twin[:,None] == self.f_edges[g]) & (f_twin >= 0)[:,None]).any(axis=1)
+
+            va = self.e_end[e]
+            vb = self.e_end[self.e_next[t]]
+            vc = self.e_end[self.e_next[e]]
+            vd = self.e_start[e]
+
+            new_err = self.triangle_errs(np.stack((np.stack((va,vc,vb),1), np.stack((vb,vc,vd),1)),1).reshape(-1,3)).reshape(-1,2)
+            new_err = new_err[:,0] + new_err[:,1]
+            curr_err = self.f_err[f] + self.f_err[g]
+
+            gain = (new_err < curr_err) | np.isnan(new_err) | np.isnan(curr_err)
+            odd = (shared != 1) | (self.e_next[t] < 0) | (self.e_next[e] < 0)
+            check[check] = ~self.f_new[g] & (gain | odd)
+            return check | invalid
+
+        def visit(e):
+            nonlocal flips
+            if self.e_twin[e] >= 0:
+                if self.he_adj_angle(e) < 135 and self.he_adj_angle(self.e_twin[e]) < 135:
+                    if self.he_test_edge_flip(e):
+                        flips += 1
+                        return (True, 6)
+            return (False, 0)
+
+        self.scan("e", candidates, visit)
+
+        if verbose:
+            print("Edge-flips realizados: " + str(flips))
+
+        return flips
+
+    # Edge collapse for mesh structure, as Mesh.edge_collapse
+    def edge_collapse(self, verbose=False):
+        collapses = 0
+
+        # CASE 1: Edge too short
+        def short_edges(edges):
+            d = self.v_pos[self.e_end[edges]] - self.v_pos[self.e_start[edges]]
+            return (d**2).sum(axis=1) < self.get_min_e_len()**2
+
+        def collapse_edge(e):
+            nonlocal collapses
+            if self.he_length_squared(e) < self.get_min_e_len()**2:
+                coll_t_1 = self.he_collapse(e)
+                if coll_t_1 > 0:
+                    collapses += 1
+                    return (True, coll_t_1*3)
+            return (False, 0)
+
+        self.scan("e", short_edges, collapse_edge)
+
+        # CASE 2: Triangle too small
+        def small_triangles(faces):
+            return self.bounding_box_areas(faces) < self.get_t_area()*0.2
+
+        def collapse_triangle(f):
+            nonlocal collapses
+            if self.tri_bounding_box_area(f) < self.get_t_area()*0.2:
+                coll_t_2 = self.he_collapse(self.tri_shortest_edge(f))
+                if coll_t_2 > 0:
+                    collapses += 1
+                    return (True, coll_t_2)
+            return (False, 0)
+
+        self.scan("f", small_triangles, collapse_triangle)
+
+        if verbose:
+            print("Edge-collapses realizados: " + str(collapses))
+
+        return collapses
+
+    # Point insertion in triangle or edge, as Mesh.insert_points
+    def insert_points(self, verbose=False):
+
+        t_inserts = 0
+        e_inserts = 0
+
+        def candidates(faces):
+            area = self.bounding_box_areas(faces)
+            err = self.f_err[faces]
+            cond_1 = area > self.get_t_area() * 3
+            cond_2 = (area >= self.get_t_area() * 0.9) & ((err > 100) | np.isnan(err))
+            return ~self.f_new[faces] & (cond_1 | cond_2)
+
+        def visit(f):
+            nonlocal t_inserts, e_inserts
+
+            if self.f_new[f]:
+                return (False, 0)
+
+            # Insertion case 1: Triangle too big
+            cond_1 = self.tri_bounding_box_area(f) > self.get_t_area() * 3
+
+            # Insertion case 2: Approximation error too high
+            cond_2 = self.tri_bounding_box_area(f) >= self.get_t_area() * 0.9 and self.tri_err(f) > 100
+
+            if cond_1 or cond_2:
+
+                # Obtuse triangle, insert on edge
+                if self.tri_largest_angle(f) > 90 or self.tri_smallest_angle(f) < 45:
+                    if self.he_test_insert_point(self.tri_longest_edge(f)):
+                        e_inserts += 1
+                        return (True, 2)
+
+                # Approximately equilateral triangle, insert in triangle
+                else:
+                    if self.tri_test_insert_point(f):
+                        t_inserts += 1
+                        return (True, 1)
+
+            return (False, 0)
+
+        self.scan("f", candidates, visit)
+
+        if verbose:
+            print("Inserciones de puntos en triángulos: " + str(t_inserts))
+            print("Inserciones de puntos en aristas: " + str(e_inserts))
+
+        return (t_inserts, e_inserts)
+
+    # Insert points if vertex isn't moving and still has approximation error
+    def insert_points_v(self, min_g, verbose=False):
+        e_inserts = 0
+
+        def candidates(vertices):
+            errs = self.v_err[vertices]
+            errs = np.where(np.isnan(errs), 0, errs)
+            still = self.v_has_dir[vertices] & (self.v_dir[vertices] == 0).all(axis=1)
+            return still & (errs > min_g)
+
+        def visit(v):
+            nonlocal e_inserts
+            if self.v_has_dir[v] and tuple(self.v_dir[v]) == (0,0) and self.vert_get_err(v) > min_g:
+                target_t = self.vert_highest_err_t(v)
+                if self.tri_bounding_box_area(target_t) >= self.get_t_area() * 0.7:
+                    if self.tri_test_insert_point(target_t):
+                        e_inserts += 1
+            return (False, 0)
+
+        self.scan("v", candidates, visit)
+
+        if verbose:
+            print("Inserciones de puntos en aristas: " + str(e_inserts))
+
+        return (0, e_inserts)
+
+    def border_update(self):
+        edges = self.slots("e")
+        edges = edges[self.e_twin[edges] >= 0]
+        faces = self.e_face[edges]
+        twin_faces = self.e_face[self.e_twin[edges]]
+
+        # New triangles update their error when reading average color
+        if self.f_new[faces].any() or self.f_new[twin_faces].any():
+            def visit(e):
+                self.he_update_is_border(e)
+                return (False, 0)
+
+            self.scan("e", lambda slots: np.ones(len(slots), dtype=bool), visit, 0, False)
+            return
+
+        self_avg = self.f_avg[faces]
+        twn_avg = self.f_avg[twin_faces]
+        if np.isnan(self_avg).any() or np.isnan(twn_avg).any():
+            raise TypeError("Triangle average not set")
+
+        self.e_border[edges] = (twn_avg > 127) & ~(self_avg > 127)
+
+    # Loops of border edges, as Mesh.border_get
+    def border_get(self):
+        loop_list = []
+        edges = self.slots("e")
+        for e in edges[self.e_border[edges]]:
+            loop = self.he_loop(e)
+            if len(loop) > 0:
+                loop_list.append(loop)
+
+        return loop_list
+
+    # Save paths in make_poly.py format, as Mesh.format_paths
+    def format_paths(self, path_list):
+
+        new_path_list = []
+
+        for path in path_list:
+            new_path = [self.pos(self.e_end[e]) for e in path]
+
+            min_y = min(new_path, key=lambda v: v[1])
+            i = new_path.index(min_y)
+
+            prev = new_path[(i-1)%len(new_path)]
+            next = new_path[(i+1)%len(new_path)]
+
+            cross = get_cross(min_y, next, min_y, prev)
+
+            hole = None
+            if cross > 0 or (cross == 0 and prev[0] < min_y[0]):
+                hole = self.tri_centroid(self.e_face[need(self.e_twin[path[0]])])
+
+            new_path_list.append((new_path, hole))
+
+        return new_path_list
+
+    # Check mesh integrity
+    def health_check(self, verbose=False):
+
+        faces = self.slots("f")
+        edges = self.slots("e")
+        vertices = self.slots("v")
+
+        # Edges of triangles form a closed loop, are associated with the
+        # triangle and are in the mesh
+        f_edges = self.f_edges[faces]
+        closed = self.e_end[f_edges] == self.e_start[np.roll(f_edges, -1, axis=1)]
+        owned = self.e_face[f_edges] == faces[:,None]
+        in_mesh = self.e_alive[f_edges] & (f_edges >= 0)
+        broken_t = np.count_nonzero(~(closed & owned & in_mesh).all(axis=1))
+
+        # Vertices of edges, opposite, previous and next edges and triangle
+        # are in the mesh and consistent
+        twin = self.e_twin[edges]
+        prev = self.e_prev[edges]
+        next = self.e_next[edges]
+        faces_e = self.e_face[edges]
+
+        ok = self.v_alive[self.e_start[edges]] & self.v_alive[self.e_end[edges]]
+        ok &= (twin < 0) | (self.e_alive[twin] & (self.e_start[twin] == self.e_end[edges]) & (self.e_end[twin] == self.e_start[edges]))
+        ok &= (prev < 0) | (self.e_alive[prev] & (self.e_end[prev] == self.e_start[edges]))
+        ok &= (next < 0) | (self.e_alive[next] & (self.e_start[next] == self.e_end[edges]))
+        ok &= (faces_e >= 0) & self.f_alive[faces_e] & (self.f_edges[faces_e] == edges[:,None]).any(axis=1)
+        broken_e = np.count_nonzero(~ok)
+
+        # Edge lists of vertices have edges in the mesh with vertex as start
+        broken_v = 0
+        for v in vertices:
+            edge_list = self.vert_edges(v)
+            if any(self.e_start[e] != v or not self.e_alive[e] for e in edge_list):
+                broken_v += 1
+                if verbose:
+                    print("\nERROR [V]: Vértice asociado a arista con distinto punto de inicio")
+                    print(str(self.pos(v)))
+
+        print("")
+        print("Broken triangles: " + str(broken_t))
+        print("Broken edges: " + str(broken_e))
+        print("Broken vertices: " + str(broken_v))
+
+    ##########################
+    #   VERTEX FUNCTIONS     #
+    ##########################
+
+    # Get color distance for all adjacent triangles, 0 if not set
+    def vert_get_err(self, v):
+        err = self.v_err[v]
+        if err != err:
+            return 0
+        return err
+
+    # Get leaving edge list
+    def vert_edges(self, v):
+        edges = []
+        e = self.v_first[v]
+        while e >= 0:
+            edges.append(e)
+            e = self.e_vnext[e]
+        return edges
+
+    # Get list of adjacent triangles
+    def vert_triangles(self, v):
+        return [self.e_face[e] for e in self.vert_edges(v)]
+
+    # Vertex and vertices of its adjacent triangles
+    def vert_ring(self, v):
+        ring = {v}
+        for f in self.vert_triangles(v):
+            for e in self.f_edges[f]:
+                ring.add(int(self.e_start[e]))
+        return ring
+
+    # Adds new edge to edge list
+    def vert_add_edge(self, v, e):
+        last = self.v_last[v]
+        self.e_vprev[e] = last
+        if last >= 0:
+            self.e_vnext[last] = e
+        else:
+            self.v_first[v] = e
+        self.v_last[v] = e
+        self.v_dirty[v] = True
+
+    # Removes edge from edge list
+    def vert_remove_edge(self, v, e):
+        if not self.e_alive[e]:
+            print("ERROR: Can't remove edge not in vertex edge list")
+            return
+
+        p = self.e_vprev[e]
+        n = self.e_vnext[e]
+        if p >= 0:
+            self.e_vnext[p] = n
+        else:
+            self.v_first[v] = n
+        if n >= 0:
+            self.e_vprev[n] = p
+        else:
+            self.v_last[v] = p
+
+        self.e_vprev[e] = -1
+        self.e_vnext[e] = -1
+        self.v_dirty[v] = True
+
+    # Check if edge exists with w as end point
+    def vert_opposite(self, v, w):
+        e = self.v_first[v]
+        while e >= 0:
+            if self.e_end[e] == w:
+                return e
+            e = self.e_vnext[e]
+        return -1
+
+    # Update approximation error, as Vertex.update_err
+    def vert_update_err(self, v, update=True):
+        v_err = 0
+        for f in self.vert_triangles(v):
+            err = self.f_err[need(f)]
+            if err != err:
+                raise TypeError("Triangle error not set")
+            v_err += err//3
+
+        if update:
+            self.v_err[v] = v_err
+            self.v_dirty[v] = False
+        return v_err
+
+    # Get next movement direction, as Vertex.update_mov_dir
+    # test_err is the result of test_mov_dirs for the vertex
+    def vert_update_mov_dir(self, v, test_err=NOT_TESTED):
+
+        if test_err is NOT_TESTED:
+            test_err = self.test_mov_dirs([v])[0]
+
+        # Sequential test is only needed if a triangle is left without points,
+        # which collapses one of its edges. It reads the errors left in the
+        # triangles by the tests of previous vertices
+        if test_err is None:
+            self.replay_tests()
+            movs = MOVEMENTS[self.v_move[v]]
+            if self.vert_get_err(v) > 50 and len(movs) >= 4:
+                movs = movs + DIAGONALS
+
+            tri_list = self.vert_triangles(v)
+            test_err = [self.vert_test_mov_dir(v, mov, tri_list) for mov in movs]
+
+        # Movement not allowed or error 0
+        elif len(test_err) == 0:
+            self.vert_set_mov_dir(v, (0,0))
+            return
+
+        else:
+            self.pending_tests.append((v, test_err[-1][1]))
+
+        # Get minimum calculated approximation error
+        min_g = min(test_err, key=lambda g: g[0])
+
+        # If test error is less than current error,
+        # set movement direction to new direction
+        if min_g[0] < self.vert_get_err(v):
+            mov_dir = min_g[1]
+        else:
+            mov_dir = (0,0)
+
+        # If error still high and no set movement, force movement
+        if mov_dir == (0,0) and self.vert_get_err(v) > 25:
+            mov_dir = max(test_err, key=lambda g: g[0])[1]
+
+        self.vert_set_mov_dir(v, mov_dir)
+
+    def vert_set_mov_dir(self, v, mov_dir):
+        self.v_dir[v] = mov_dir
+        self.v_has_dir[v] = True
+
+    # Candidate new position, as Vertex.test_mov_dir
+    def vert_test_mov_dir(self, v, mov, tri_list):
+
+        self.vert_move(v, mov)
+
+        for f in tri_list:
+            self.tri_update_err(f)
+
+        err = self.vert_update_err(v, False)
+
+        self.vert_move(v, (-mov[0],-mov[1]))
+
+        return (err, mov)
+
+    # Move vertex in a direction, adjacent triangles must be updated
+    def vert_move(self, v, mov):
+        self.v_pos[v] += mov
+        for f in self.vert_triangles(v):
+            if f >= 0:
+                self.f_dirty[f] = True
+        self.version += 1
+
+    # Get triangle with highest approximation error
+    def vert_highest_err_t(self, v):
+        tri_list = self.vert_triangles(v)
+        errs = [self.tri_err(f) for f in tri_list]
+        if len(errs) > 1 and None in errs:
+            raise TypeError("Triangle error not set")
+        return tri_list[errs.index(max(errs))]
+
+    # Get first associated border edge
+    def vert_border(self, v):
+        for e in self.vert_edges(v):
+            if self.e_border[e]:
+                return e
+        return -1
+
+    ##########################
+    #    EDGE FUNCTIONS      #
+    ##########################
+
+    # Follow references from edge, as Edge.get_s. Returns -1 for None
+    def he_s(self, e, s):
+        curr = e
+        for c in s:
+            match c:
+                case "s":
+                    curr = self.e_start[curr]
+                case "e":
+                    curr = self.e_end[curr]
+                case "o":
+                    curr = self.e_twin[curr]
+                case "p":
+                    curr = self.e_prev[curr]
+                case "n":
+                    curr = self.e_next[curr]
+                case "t":
+                    curr = self.e_face[curr]
+            if curr < 0:
+                break
+
+        return curr
+
+    def he_length_squared(self, e):
+        return dist_squared(self.pos(self.e_start[e]), self.pos(self.e_end[e]))
+
+    def he_midpoint(self, e):
+        start_t = self.pos(self.e_start[e])
+        end_t = self.pos(self.e_end[e])
+        return ((start_t[0] + end_t[0])//2, (start_t[1] + end_t[1])//2)
+
+    # Get angle opposite to edge
+    def he_opp_angle(self, e):
+        v = self.pos(need(self.he_s(e, "ne")))
+        a = self.pos(self.e_start[e])
+        b = self.pos(self.e_end[e])
+        return get_angle(v,a,v,b)
+
+    # Get sum of angles opposite to edge and opposite edge
+    def he_opp_angle_sum(self, e):
+        if self.e_twin[e] >= 0:
+            return self.he_opp_angle(e) + self.he_opp_angle(self.e_twin[e])
+        return None
+
+    def he_adj_angle(self, e):
+        if self.e_twin[e] < 0:
+            return 0
+
+        v = self.pos(self.e_start[e])
+        a = self.pos(need(self.he_s(e, "one")))
+        b = self.pos(need(self.he_s(e, "ps")))
+
+        angle = get_angle(v,a,v,b)
+        cross = get_cross(b,v,v,a)
+
+        if cross < 0:
+            return angle
+        else:
+            return 360-angle
+
+    # If adjacent triangle is white and twin is black, set as border
+    def he_update_is_border(self, e):
+        twn = self.e_twin[e]
+        if twn >= 0:
+            self_avg = self.tri_avg(self.e_face[e])
+            twn_avg = self.tri_avg(self.e_face[twn])
+
+            c1 = self_avg > 127
+            c2 = twn_avg > 127
+
+            self.e_border[e] = c2 and not c1
+
+    # Get complete path of border edges
+    def he_loop(self, e):
+        if not self.e_border[e]:
+            return []
+
+        curr_e = e
+        loop = [e]
+        while True:
+            next_border = self.vert_border(self.e_end[curr_e])
+            self.e_border[curr_e] = False
+            if next_border >= 0:
+                loop.append(next_border)
+                curr_e = next_border
+            else:
+                break
+
+        return loop
+
+    # Check if edge collapse is possible
+    def he_can_collapse(self, e):
+        if self.e_twin[e] < 0:
+            return False
+
+        start_t = self.pos(self.e_start[e])
+        end_t = self.pos(self.e_end[e])
+
+        if 0 in start_t or 0 in end_t:
+            return False
+
+        max_x = self.image.dims[0]-1
+        max_y = self.image.dims[1]-1
+
+        if max_x == start_t[0] or max_x == end_t[0]:
+            return False
+
+        if max_y == start_t[1] or max_y == end_t[1]:
+            return False
+
+        return True
+
+    # Remove edge and reassign connected edges, as Edge.edge_collapse
+    def he_collapse(self, e, retry=False):
+
+        if not self.he_can_collapse(e):
+            return 0
+
+        del_v = self.e_start[e]
+        end_v = self.e_end[e]
+
+        prev_e = self.he_s(e, "ono")
+        if prev_e < 0:
+            return 0
+        next_e = self.he_s(e, "p")
+
+        # If adjacent angles are too large, retry edge collapse in opposite direction
+        if self.he_adj_angle(prev_e) > 175 or self.he_adj_angle(need(next_e)) > 175:
+            if not retry:
+                return self.he_collapse(self.e_twin[e], True)
+            else:
+                return 0
+
+        # Get neighboring vertices
+        curr = e
+        ring = []
+        while True:
+            if self.f_new[need(self.e_face[curr])]:
+                return 0
+            curr = need(self.he_s(curr, "po"))
+            if self.e_end[curr] != end_v:
+                ring.append(self.e_end[curr])
+            else:
+                break
+
+        # Removing edges, triangles and vertex
+        removed_t = 0
+        while self.v_first[del_v] >= 0:
+            self.tri_remove(need(self.e_face[self.v_first[del_v]]))
+            removed_t += 1
+
+        self.remove_vertex(del_v)
+
+        # Generating new triangles
+        for i in range(len(ring)-1):
+            new_tri = self.connect_3([ring[i],ring[i+1],end_v])
+            self.tri_update_err(new_tri)
+
+        for v in ring:
+            self.vert_update_err(v)
+        self.vert_update_err(end_v)
+
+        return removed_t
+
+    # Point insertion in edge midpoint
+    def he_insert_point(self, e):
+
+        twin = self.e_twin[e]
+        if twin < 0:
+            return False
+
+        if self.f_new[self.e_face[twin]]:
+            return False
+
+        # Creating new midpoint vertex
+        x,y = self.he_midpoint(e)
+        new_v = self.make_vertex(x,y)
+        self.v_move[new_v] = 3
+
+        va = self.e_end[e]
+        vb = need(self.he_s(e, "one"))
+        vc = need(self.he_s(e, "ne"))
+        vd = self.e_start[e]
+
+        self.tri_remove(self.e_face[twin])
+        self.tri_remove(self.e_face[e])
+
+        new_t = [
+            self.connect_3([va,vc,new_v]),
+            self.connect_3([vc,vd,new_v]),
+            self.connect_3([vd,vb,new_v]),
+            self.connect_3([vb,va,new_v])
+        ]
+
+        for f in new_t:
+            self.tri_update_err(f)
+
+        for v in [va,vb,vc,vd,new_v]:
+            self.vert_update_err(v)
+
+        return True
+
+    # Check if edges generated by point insertion exceed minimum edge length
+    def he_test_insert_point(self, e):
+
+        new_v = self.he_midpoint(e)
+
+        vertices = [self.e_end[e], need(self.he_s(e, "one")), need(self.he_s(e, "ne")), self.e_start[e]]
+        min_len = min(dist_squared(new_v, self.pos(v)) for v in vertices)
+
+        if min_len > self.get_min_e_len()**2:
+            return self.he_insert_point(e)
+
+        else:
+            return False
+
+    # Do edge flip in adjacent and opposite triangle
+    def he_edge_flip(self, e):
+        if self.e_twin[e] >= 0:
+            return self.tri_edge_flip(self.e_face[e], self.e_face[self.e_twin[e]])
+        return False
+
+    def he_test_edge_flip(self, e):
+        if self.e_twin[e] >= 0:
+            return self.tri_test_edge_flip(self.e_face[e], self.e_face[self.e_twin[e]])
+        return False
+
+    ##########################
+    #   TRIANGLE FUNCTIONS   #
+    ##########################
+
+    # Get approximation error, None if not set
+    def tri_err(self, f):
+        err = self.f_err[f]
+        if err != err:
+            return None
+        return err
+
+    # Get average color, updated for new triangles
+    def tri_avg(self, f):
+        if self.f_new[f]:
+            self.tri_update_err(f)
+        avg = self.f_avg[f]
+        if avg != avg:
+            return None
+        return avg
+
+    def tri_vertices(self, f):
+        return [self.e_start[e] for e in self.f_edges[f]]
+
+    def tri_vertices_t(self, f):
+        return [self.pos(v) for v in self.tri_vertices(f)]
+
+    # Average color and number of points, as Triangle.update_err
+    def span_values(self, vertices):
+        lengths, sums = span_sums(triangle_spans(vertices), self.image.row_sums)
+
+        wide = np.flatnonzero(lengths > 1)
+        first = wide[0] if len(wide) > 0 else len(lengths)-1
+
+        l = int(lengths[first:].sum())
+        total = int(sums[first:].sum())
+
+        if l == 0:
+            return None, 0
+        return np.float64(total)/l, l
+
+    # Approximation error of a triangle not in mesh, None if no points
+    def test_err(self, vertices):
+        avg, l = self.span_values(vertices)
+        if l == 0:
+            return None
+        if avg > 127:
+            return 255 - avg
+        return avg
+
+    # Update average color and approximation error, as Triangle.update_err
+    def tri_update_err(self, f):
+
+        self.f_dirty[f] = False
+        avg, l = self.span_values(self.tri_vertices_t(f))
+
+        if l == 0:
+            self.he_collapse(self.tri_shortest_edge(f))
+
+        # Approximation error is distance to 0 or 255
+        else:
+            self.f_avg[f] = avg
+            if avg > 127:
+                self.f_err[f] = 255 - avg
+            else:
+                self.f_err[f] = avg
+            for v in self.tri_vertices(f):
+                self.v_dirty[v] = True
+
+        self.f_new[f] = False
+        self.version += 1
+
+        return self.tri_err(f)
+
+    # Removes triangle and edges, vertices remain
+    def tri_remove(self, f):
+        for e in self.f_edges[f].tolist():
+            self.remove_edge(e)
+        self.remove_triangle(f)
+
+    # Flip shared edge between two triangles
+    def tri_edge_flip(self, f, f2):
+
+        if self.f_new[f2]:
+            return False
+
+        shared = self.tri_shared_edge(f, f2)
+        if shared < 0:
+            return
+
+        # a b       Change from [\] -> acd , adb
+        # c d       to [/]          -> acb , bcd
+        va = self.e_end[shared]
+        vb = need(self.he_s(shared, "one"))
+        vc = need(self.he_s(shared, "ne"))
+        vd = self.e_start[shared]
+
+        # Remove old triangles
+        self.tri_remove(f)
+        self.tri_remove(self.e_face[need(self.e_twin[shared])])
+
+        # Create new triangles
+        t_1 = self.connect_3([va,vc,vb])
+        t_2 = self.connect_3([vb,vc,vd])
+
+        self.tri_update_err(t_1)
+        self.tri_update_err(t_2)
+
+        for v in [va,vb,vc,vd]:
+            self.vert_update_err(v)
+
+        return True
+
+    # Flip shared edge if it reduces approximation error
+    def tri_test_edge_flip(self, f, f2):
+
+        if self.f_new[f2]:
+            return False
+
+        shared = self.tri_shared_edge(f, f2)
+        if shared < 0:
+            return
+
+        err_1 = self.tri_err(self.e_face[shared])
+        err_2 = self.tri_err(need(self.he_s(shared, "ot")))
+        curr_err = err_1 + err_2
+
+        va = self.pos(self.e_end[shared])
+        vb = self.pos(need(self.he_s(shared, "one")))
+        vc = self.pos(need(self.he_s(shared, "ne")))
+        vd = self.pos(self.e_start[shared])
+
+        # Get approximation error from new triangles
+        new_err = self.test_err([va,vc,vb]) + self.test_err([vb,vc,vd])
+
+        if new_err < curr_err:
+            return self.tri_edge_flip(f, f2)
+
+        return False
+
+    # Insert new vertex in centroid of triangle
+    def tri_insert_point(self, f):
+        x,y = self.tri_centroid(f)
+
+        v1,v2,v3 = self.tri_vertices(f)
+
+        new_v = self.make_vertex(x,y)
+        self.v_move[new_v] = 3
+
+        self.tri_remove(f)
+
+        new_t = [
+            self.connect_3([v1,v2,new_v]),
+            self.connect_3([v2,v3,new_v]),
+            self.connect_3([v3,v1,new_v])
+        ]
+
+        for t in new_t:
+            self.tri_update_err(t)
+
+        for v in [v1,v2,v3,new_v]:
+            self.vert_update_err(v)
+
+        return True
+
+    # Check if edges generated by point insertion exceed minimum edge length
+    def tri_test_insert_point(self, f):
+        c = self.tri_centroid(f)
+        min_len = min(dist_squared(c, v) for v in self.tri_vertices_t(f))
+
+        if min_len > self.get_min_e_len()**2:
+            return self.tri_insert_point(f)
+
+        else:
+            return False
+
+    # Get centroid of triangle
+    def tri_centroid(self, f):
+        verts = self.tri_vertices_t(f)
+        x = (verts[0][0] + verts[1][0] + verts[2][0])//3
+        y = (verts[0][1] + verts[1][1] + verts[2][1])//3
+
+        return (x,y)
+
+    # Last edge of triangle with opposite edge in other triangle
+    def tri_shared_edge(self, f, f2):
+        shared = -1
+        edges_2 = self.f_edges[f2].tolist()
+        for e in self.f_edges[f]:
+            twin = self.e_twin[e]
+            if twin >= 0 and twin in edges_2:
+                shared = e
+
+        return shared
+
+    def tri_longest_edge(self, f):
+        return sorted(self.f_edges[f], key=self.he_length_squared)[2]
+
+    def tri_shortest_edge(self, f):
+        return sorted(self.f_edges[f], key=self.he_length_squared)[0]
+
+    def tri_largest_angle(self, f):
+        return max(self.he_opp_angle(e) for e in self.f_edges[f])
+
+    def tri_smallest_angle(self, f):
+        return min(self.he_opp_angle(e) for e in self.f_edges[f])
+
+    def tri_bounding_box_area(self, f):
+        verts = self.tri_vertices_t(f)
+
+        v_x = [v[0] for v in verts]
+        v_y = [v[1] for v in verts]
+
+        return (max(v_x) - min(v_x))*(max(v_y) - min(v_y))
+
+    def bounding_box_areas(self, faces):
+        points = self.v_pos[self.e_start[self.f_edges[faces]]]
+        size = points.max(axis=1) - points.min(axis=1)
+        return size[:,0]*size[:,1]
+
+    #######################
+    # AUXILIARY FUNCTIONS #
+    #######################
+
+    # Get error totals for vertices and triangles
+    def error_totals(self):
+        v_err = 0
+        for err in self.v_err[self.slots("v")].tolist():
+            if err == err:
+                v_err += err
+
+        t_err = 0
+        for err in self.f_err[self.slots("f")].tolist():
+            if err != err:
+                raise TypeError("Triangle error not set")
+            t_err += err
+
+        return [v_err, t_err]
+
+    # Get maximum and minimum errors for log
+    def err_max_min(self):
+        v_errs = self.v_err[self.slots("v")]
+        v_errs = np.where(np.isnan(v_errs), 0, v_errs)
+
+        t_errs = self.f_err[self.slots("f")]
+        if np.isnan(t_errs).any():
+            raise TypeError("Triangle error not set")
+
+        return [v_errs.min(), v_errs.max(), t_errs.min(), t_errs.max()]
+
+    #####################
+    # DRAWING FUNCTIONS #
+    #####################
+
+    # Draw triangles with approximation error, as Mesh.draw_triangles
+    def draw_triangles(self, img, color="avg"):
+        for f in self.slots("f"):
+            if color == "avg":
+                c = self.f_avg[f]
+            else:
+                c = self.f_err[f]*2
+            for y, x0, x1 in triangle_spans(self.tri_vertices_t(f)).tolist():
+                cv2.line(img, (x0,y), (x1,y), [c,c,c], 1)
+
+        return img
+
+    # Draw mesh edges, as Mesh.draw_edges
+    def draw_edges(self, img, same=False):
+        for e in self.slots("e"):
+            p1 = self.pos(self.e_start[e])
+            p2 = self.pos(self.e_end[e])
+            if self.e_border[e]:
+                if same:
+                    cv2.line(img, p1, p2, (0,255,0), 1)
+                else:
+                    cv2.line(img, p1, p2, (0,0,255), 2)
+            else:
+                twin = self.e_twin[e]
+                if twin < 0 or not self.e_border[twin]:
+                    cv2.line(img, p1, p2, (0,255,0), 1)
+
+        return img
+
+    # Draw mesh vertices, as Mesh.draw_vertices
+    def draw_vertices(self, img, v_err=True):
+        for v in self.slots("v"):
+
+            col = (0,0,0)
+
+            if v_err:
+                c = self.vert_get_err(v)*6
+                if c > 255:
+                    c = 255
+                col = (c,0,0)
+
+            cv2.circle(img, self.pos(v), 3, col, -1)
+
+        return img
@@ -1,51 +1,17 @@
 from .mesh import *
 import cv2
 import time
+import traceback
 import imageio
 
-# Save paths in make_poly.py format
-def format_paths(path_list):
-        
-    def get_cross(p1,p2,q1,q2):
-        a_0 = [p2[0]-p1[0],p2[1]-p1[1]]
-        b_0 = [q2[0]-q1[0],q2[1]-q1[1]]
-
-        return np.cross(a_0,b_0)
-
-    new_path_list = []
-    
-    for path in path_list:
-        new_path = [e.get_end().to_tuple() for e in path]
-
-        min_y = min(new_path, key=lambda v: v[1])
-        i = new_path.index(min_y)
-        
-        prev = new_path[(i-1)%len(new_path)]
-        next = new_path[(i+1)%len(new_path)]
-
-        edge_1 = [min_y, next]
-        edge_2 = [prev, min_y]
-
-        cross = get_cross(edge_1[0], edge_1[1], edge_2[1], edge_2[0])
-
-        hole = None
-        if cross > 0:
-            hole = path[0].get_twin().get_triangle().centroid()
-        if cross == 0:
-            if prev[0] < min_y[0]:
-                hole = path[0].get_twin().get_triangle().centroid()
-
-        new_path_list.append((new_path, hole))
-
-    return new_path_list
-
 # Main function
-def main(filename, triangle_dim, iterations, bw_thresh, min_e_len, verbose=False, lapse=False, lapse_img="color"):
+def main(filename, triangle_dim, iterations, bw_thresh, min_e_len, verbose=False, lapse=False, lapse_img="color", engine="objects", workers=1):
 
     new_img = Image(filename, bw_thresh)
+    new_img.set_workers(workers)
 
     x_tri, y_tri = triangle_dim
-    new_img.add_mesh(x_tri, y_tri, min_e_len)
+    new_img.add_mesh(x_tri, y_tri, min_e_len, False, engine)
 
     counter = 0
     borders = []
@@ -67,95 +33,98 @@ def main(filename, triangle_dim, iterations, bw_thresh, min_e_len, verbose=False
 
     new_img.update_all()
 
-    while True:
+    # Worker processes for vertex movement, kept for every iteration
+    with new_img.open_pool():
+        while True:
 
-        try:
+            try:
 
-            # Border check (only final iteration)
-            if counter == iterations:
-                new_img.border_update()
+                # Border check (only final iteration)
+                if counter == iterations:
+                    new_img.border_update()
 
-            # This is only necessary for timelapse
-            if lapse or (not lapse and counter == iterations):
-                new_frame = new_img.draw_full(lapse_img)
-                frames.append(new_frame)
-                #cv2.imwrite("Iterations/" + str(counter) + ".png", new_frame)
+                # This is only necessary for timelapse
+                if lapse or (not lapse and counter == iterations):
+                    new_frame = new_img.draw_full(lapse_img)
+                    frames.append(new_frame)
+                    #cv2.imwrite("Iterations/" + str(counter) + ".png", new_frame)
 
-            if counter == iterations:
-                borders = format_paths(new_img.border_get())
+                if counter == iterations:
+                    borders = new_img.format_paths(new_img.border_get())
 
-            # This is only necessary for final print
-            errs = new_img.error_totals()
-            v_errs.append(round(errs[0]/len(new_img.mesh.get_vertices()),2))
-            t_errs.append(round(errs[1]/len(new_img.mesh.get_triangles()),2))
+                # This is only necessary for final print
+                errs = new_img.error_totals()
+                v_errs.append(round(errs[0]/len(new_img.mesh.get_vertices()),2))
+                t_errs.append(round(errs[1]/len(new_img.mesh.get_triangles()),2))
 
-            counter += 1
-            if counter >= iterations+1:
-                break
+                counter += 1
+                if counter >= iterations+1:
+                    break
 
-            step_size = 1
+                step_size = 1
 
-            curr_it = "Iteración " + str(counter) + " / " + str(iterations)
-            padding = " "*(18-len(curr_it))
-            bar = "[" + "#"*counter + "-"*(iterations-counter) + "]"
-            status = curr_it+padding+bar
+                curr_it = "Iteración " + str(counter) + " / " + str(iterations)
+                padding = " "*(18-len(curr_it))
+                bar = "[" + "#"*counter + "-"*(iterations-counter) + "]"
+                status = curr_it+padding+bar
 
-            if not verbose:
-                if counter < iterations:
-                    print(status, end='\r')
-                    print(end='', flush=True)
+                if not verbose:
+                    if counter < iterations:
+                        print(status, end='\r')
+                        print(end='', flush=True)
+                    else:
+                        print(status+"\n")
                 else:
-                    print(status+"\n")
-            else:
-                if counter > 1:
-                    print("\n"+status+"\n")
-                else:
-                    print(status+"\n")
+                    if counter > 1:
+                        print("\n"+status+"\n")
+                    else:
+                        print(status+"\n")
 
-            # REFINEMENT
+                # REFINEMENT
 
-            # A. Improve approximation:
-            # 1. Move vertices
-            if counter < 15:
-                new_img.move_vertices(step_size)
-            else:
-                new_img.move_vertices_seq(step_size)
+                # A. Improve approximation:
+                # 1. Move vertices
+                if counter < 15:
+                    new_img.move_vertices(step_size)
+                else:
+                    new_img.move_vertices_seq(step_size)
 
-            new_img.update_all()
+                new_img.update_all()
 
-            # 2. Edge flip for approximation error
-            flips += new_img.edge_flip_g(verbose)
+                # 2. Edge flip for approximation error
+                flips += new_img.edge_flip_g(verbose)
 
-            # 3. Point insertion
-            inserts = (0,0)
-            if counter > 5 and counter < iterations-5:
-                if counter%2 == 0:
-                    inserts = new_img.insert_points(verbose)
-                else:
-                    inserts = new_img.insert_points_v(10,verbose)
+                # 3. Point insertion
+                inserts = (0,0)
+                if counter > 5 and counter < iterations-5:
+                    if counter%2 == 0:
+                        inserts = new_img.insert_points(verbose)
+                    else:
+                        inserts = new_img.insert_points_v(10,verbose)
                     
-            t_inserts += inserts[0]
-            e_inserts += inserts[1]
+                t_inserts += inserts[0]
+                e_inserts += inserts[1]
 
-            # B. Restore triangulation
-            # 4. Edge-flip
-            flips += new_img.edge_flip(verbose)
+                # B. Restore triangulation
+                # 4. Edge-flip
+                flips += new_img.edge_flip(verbose)
 
-            #new_img.health_check(True)
+                #new_img.health_check(True)
 
-            # 5. Edge-collapse
-            collapses += new_img.edge_collapse(verbose)
+                # 5. Edge-collapse
+                collapses += new_img.edge_collapse(verbose)
             
-            #new_img.health_check()
+                #new_img.health_check()
 
-            # Only necessary for final print
-            t1 = time.time()
-            times.append(round(t1-t0,2))
-            t0 = t1
+                # Only necessary for final print
+                t1 = time.time()
+                times.append(round(t1-t0,2))
+                t0 = t1
         
-        except Exception as e:
-            print("Error durante la ejecución. Por favor reintentar con otro conjunto de parámetros.\n")
-            return [[], None]
+            except Exception as e:
+                traceback.print_exc()
+                print("Error durante la ejecución. Por favor reintentar con otro conjunto de parámetros.\n")
+                return [[], None]
 
     # End of refinement
 
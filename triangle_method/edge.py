@@ -1,5 +1,5 @@
-import math
 import numpy as np
+from geometry import *
 
 # Edge class
 class Edge:
@@ -83,6 +83,7 @@ class Edge:
     
     def set_triangle(self, t):
         self.triangle = t
+        self.get_start().set_dirty()
     
     def set_prev(self, e):
         if e:
@@ -167,23 +168,6 @@ class Edge:
     # Get angle opposite to edge
     def get_opp_angle(self):
 
-        def get_angle(p1,p2,q1,q2):
-            v1 = [(p2[0]-p1[0]),(p2[1]-p1[1])]
-            v2 = [(q2[0]-q1[0]),(q2[1]-q1[1])]
-
-            dot = v1[0]*v2[0] + v1[1]*v2[1]
-
-            mv1 = math.sqrt(v1[0]**2+v1[1]**2)
-            mv2 = math.sqrt(v2[0]**2+v2[1]**2)
-
-            a = dot/(mv1*mv2)
-            if a > 1:
-                a = 1
-            if a < -1:
-                a = -1
-
-            return int(math.degrees(math.acos(a)))
-    
         v = self.get_s("ne").to_tuple()
         a = self.get_start().to_tuple()
         b = self.get_end().to_tuple()
@@ -202,29 +186,6 @@ class Edge:
     
     def get_adj_angle(self):
 
-        def get_angle(p1,p2,q1,q2):
-            v1 = [(p2[0]-p1[0]),(p2[1]-p1[1])]
-            v2 = [(q2[0]-q1[0]),(q2[1]-q1[1])]
-
-            dot = v1[0]*v2[0] + v1[1]*v2[1]
-
-            mv1 = math.sqrt(v1[0]**2+v1[1]**2)
-            mv2 = math.sqrt(v2[0]**2+v2[1]**2)
-
-            a = dot/(mv1*mv2)
-            if a > 1:
-                a = 1
-            if a < -1:
-                a = -1
-
-            return int(math.degrees(math.acos(a)))
-        
-        def get_cross(p1,p2,q1,q2):
-            a_0 = [p2[0]-p1[0],p2[1]-p1[1]]
-            b_0 = [q2[0]-q1[0],q2[1]-q1[1]]
-
-            return np.cross(a_0,b_0)
-        
         if not self.get_twin():
             return 0
 
@@ -242,10 +203,11 @@ class Edge:
 
     # Get edge length
     def length(self):
-        v1 = self.get_start_t()
-        v2 = self.get_end_t()
+        return dist_two_points(self.get_start_t(), self.get_end_t())
 
-        return math.sqrt(((v2[0]-v1[0])**2)+((v2[1]-v1[1])**2))
+    # Get squared edge length, for comparisons without sqrt
+    def length_squared(self):
+        return dist_squared(self.get_start_t(), self.get_end_t())
     
     # Get point between start and end point
     def get_midpoint(self):
@@ -377,9 +339,9 @@ class Edge:
 
         edges = [self.mesh.make_edge(new_v,v,False) for v in vertices]
 
-        min_edge = min(edges, key=lambda e: e.length())
+        min_edge = min(edges, key=lambda e: e.length_squared())
 
-        if min_edge.length() > self.get_mesh().get_min_e_len():
+        if min_edge.length_squared() > self.get_mesh().get_min_e_len()**2:
             return self.insert_point()
 
         else:
@@ -0,0 +1,122 @@
+# Ordered list of mesh elements with constant time membership and removal
+# Removed elements leave an empty slot, and a Fenwick tree over the slots
+# keeps the position of every element, so indexing and iteration behave as
+# in a list while elements are added and removed
+class ElementList:
+    def __init__(self):
+        self.slots = []     # Elements in insertion order, None if removed
+        self.slot = {}      # Slot of every element
+        self.tree = [0]     # Fenwick tree of element count, 1-based
+        self.size = 0       # Number of elements
+
+        # Last position and slot accessed, for sequential indexing
+        self.last = (-1, -1)
+
+    ###############
+    #   GETTERS   #
+    ###############
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, element):
+        return element in self.slot
+
+    # Get element at position i, as in a list
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.size
+        if i < 0 or i >= self.size:
+            raise IndexError("ElementList index out of range")
+
+        last_i, last_s = self.last
+
+        # Next position is the next used slot after last access
+        if i == last_i+1:
+            s = last_s+1
+            while self.slots[s] is None:
+                s += 1
+        elif i == last_i:
+            s = last_s
+        else:
+            s = self.find(i)
+
+        self.last = (i, s)
+        return self.slots[s]
+
+    # Iterate by position, as a list iterator, so elements added or
+    # removed during iteration are handled as in a list
+    def __iter__(self):
+        i = 0
+        while i < self.size:
+            yield self[i]
+            i += 1
+
+    ###############
+    #   SETTERS   #
+    ###############
+
+    def append(self, element):
+        self.slots.append(element)
+        self.slot[element] = len(self.slots)-1
+        self.size += 1
+
+        # New node counts its own slot and the slots of its children
+        k = len(self.slots)
+        self.tree.append(1 + self.prefix(k-1) - self.prefix(k - (k & -k)))
+
+    def remove(self, element):
+        s = self.slot.pop(element)
+        self.slots[s] = None
+        self.size -= 1
+        self.update(s, -1)
+
+        # Position of last access changes if it was after removed element
+        if self.last[1] >= s:
+            self.last = (-1, -1)
+
+        if len(self.slots) > 64 and self.size < len(self.slots)//2:
+            self.compact()
+
+    #######################
+    # AUXILIARY FUNCTIONS #
+    #######################
+
+    # Number of elements in slots before slot k
+    def prefix(self, k):
+        total = 0
+        while k > 0:
+            total += self.tree[k]
+            k -= k & -k
+        return total
+
+    # Add value to count of slot s
+    def update(self, s, value):
+        k = s+1
+        while k < len(self.tree):
+            self.tree[k] += value
+            k += k & -k
+
+    # Get slot of element at position i
+    def find(self, i):
+        k = 0
+        remaining = i+1
+        step = 1 << (len(self.tree)-1).bit_length()
+
+        while step > 0:
+            if k+step < len(self.tree) and self.tree[k+step] < remaining:
+                k += step
+                remaining -= self.tree[k]
+            step >>= 1
+
+        return k
+
+    # Remove empty slots, positions of elements don't change
+    def compact(self):
+        self.slots = [e for e in self.slots if e is not None]
+        self.slot = {e: s for s, e in enumerate(self.slots)}
+
+        # Every slot is used, node k counts its lowest bit in slots
+        self.tree = [0] + [k & -k for k in range(1, len(self.slots)+1)]
+
+        self.last = (-1, -1)
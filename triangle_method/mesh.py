@@ -1,9 +1,16 @@
 import cv2
 import random
 import copy
+from contextlib import contextmanager
 from .vertex import *
 from .edge import *
 from .triangle import *
+from .element_list import ElementList
+from .array_mesh import ArrayMesh
+from .star_pool import StarPool
+
+# Vertices whose movement is tested at once in a pool
+POOL_BATCH = 1 << 16
 
 # Mesh class, contains list of vertices, edges and triangles
 # Always associated with underlying image
@@ -13,13 +20,20 @@ class Mesh:
         self.image = image # Associated Image object
         self.min_e_len = min_e_len # Minimum edge length for mesh
 
-        # Element arrays
-        self.vertices = []
-        self.edges = []
-        self.triangles = []
+        # Element lists
+        self.vertices = ElementList()
+        self.edges = ElementList()
+        self.triangles = ElementList()
+
+        # Edges of mesh by start and end vertex, for twin lookup
+        self.edge_map = {}
 
         self.t_area = None # Initial triangle area
 
+        # Vertices whose movement was tested without moving them, with their
+        # last candidate direction
+        self.pending_tests = []
+
     ###############
     #   GETTERS   #
     ###############
@@ -39,6 +53,13 @@ class Mesh:
     def get_min_e_len(self):
         return self.min_e_len
 
+    # Get first edge of mesh from start_v to end_v
+    def find_edge(self, start_v, end_v):
+        edges = self.edge_map.get((start_v, end_v))
+        if edges:
+            return edges[0]
+        return None
+
     ###############
     #   SETTERS   #
     ###############
@@ -55,10 +76,16 @@ class Mesh:
     
     def add_edge(self, edge):
         self.edges.append(edge)
+        self.edge_map.setdefault((edge.get_start(), edge.get_end()), []).append(edge)
 
     def remove_edge(self, edge):
         if edge in self.edges:
             self.edges.remove(edge)
+
+            key = (edge.get_start(), edge.get_end())
+            self.edge_map[key].remove(edge)
+            if len(self.edge_map[key]) == 0:
+                del self.edge_map[key]
         else:
             print("ERROR: Can't remove edge not in mesh edge list")
             return
@@ -96,7 +123,12 @@ class Mesh:
 
         start_v.add_edge(new_e)
 
-        opp_e = end_v.check_opposite(start_v)
+        # Edges not added to mesh have test vertices
+        if add:
+            opp_e = self.find_edge(end_v, start_v)
+        else:
+            opp_e = end_v.check_opposite(start_v)
+
         if opp_e:
             new_e.set_twin(opp_e)
             opp_e.set_twin(new_e)
@@ -220,45 +252,135 @@ class Mesh:
     #   UPDATERS   #
     ################
 
-    # Update approximation error for every triangle
+    # Update approximation error for every dirty triangle
     # True parameter ensures that points and color
-    # will be recalculated
+    # will be recalculated. Triangles with no moved
+    # vertices would get the same error
     def update_triangles(self):
         for t in self.get_triangles():
-            t.update_err(True)
+            if t.get_dirty():
+                t.update_err(True)
 
-    # Update approximation error for every vertex
+    # Update approximation error for every dirty vertex
     # No parameters means that the error value
-    # will be updated for every vertex
+    # will be updated. Vertices with no changed
+    # triangles would get the same error
     def update_vertices(self):
         for v in self.get_vertices():
-            v.update_err()
+            if v.get_dirty():
+                v.update_err()
     
     # For every vertex, the movement direction is calculated again
     # and then the vertices are moved in that direction
     # step size can be modified for testing purposes
-    def move_vertices(self, step=1, verbose=None):
+    # Movement errors are calculated by worker processes if pool is given
+    def move_vertices(self, step=1, verbose=None, pool=None):
 
         total_v = len(self.get_vertices())
         counter = 1
-        for v in self.get_vertices():
-            if verbose:
-                s = "[" + str(counter) + "/" + str(total_v) + "] " + verbose
-                print(s)
-                counter += 1
-            v.update_mov_dir()
+        self.pending_tests = []
+
+        if pool is not None:
+            self.update_mov_dirs(pool, verbose)
+        else:
+            for v in self.get_vertices():
+                if verbose:
+                    s = "[" + str(counter) + "/" + str(total_v) + "] " + verbose
+                    print(s)
+                    counter += 1
+                v.update_mov_dir()
 
+        self.pending_tests = []
         for v in self.get_vertices():
             if v.get_mov_dir() != (0,0):
                 x,y = v.get_mov_dir()
                 v.move((x*step,y*step))
 
+    # Test the last candidate direction of every pending vertex again, leaving
+    # their triangles as the sequential test of update_mov_dir would
+    def replay_tests(self):
+        for v, mov in self.pending_tests:
+            v.test_mov_dir(mov, v.adjacent_triangles())
+        self.pending_tests = []
+
+    # Movement direction of every vertex, as update_mov_dir, with the errors of
+    # batches of vertices calculated by pool. If a vertex needs the sequential
+    # test the mesh changes, and next vertices are tested again
+    def update_mov_dirs(self, pool, verbose=None):
+
+        vertices = self.get_vertices()
+        total_v = len(vertices)
+
+        i = 0
+        while i < len(vertices):
+            batch = [vertices[k] for k in range(i, min(i + POOL_BATCH, len(vertices)))]
+            tests = self.test_mov_dirs(batch, pool)
+
+            for k in range(len(batch)):
+                if verbose:
+                    s = "[" + str(i+k+1) + "/" + str(total_v) + "] " + verbose
+                    print(s)
+                batch[k].update_mov_dir(tests[k])
+                if tests[k] is None:
+                    break
+
+            i += k+1
+
+    # Approximation error of every candidate direction of vertices vs, as
+    # Vertex.test_mov_dirs, calculated by pool. For each vertex returns an
+    # empty list if it can't move, None if a triangle is left without points
+    # or a list of (error, direction) tuples
+    def test_mov_dirs(self, vs, pool):
+        tests = [[] for v in vs]
+
+        owners = []
+        tri = []
+        is_self = []
+        n_faces = []
+        offsets = []
+        n_movs = []
+        for k in range(len(vs)):
+            movs = vs[k].candidate_movs()
+            if len(movs) == 0:
+                continue
+
+            tri_list = vs[k].adjacent_triangles()
+            for t in tri_list:
+                tri.append(t.vertex_list_t())
+                is_self.append([v is vs[k] for v in t.vertex_list()])
+
+            owners.append(k)
+            n_faces.append(len(tri_list))
+            offsets += movs
+            n_movs.append(len(movs))
+
+        if len(owners) == 0:
+            return tests
+
+        errs, empty = pool.star_errs(np.array(tri, dtype=np.int64).reshape(-1,3,2),
+                                     np.array(is_self, dtype=bool).reshape(-1,3),
+                                     np.array(n_faces), np.array(offsets, dtype=np.int64),
+                                     np.array(n_movs))
+        errs = errs.tolist()
+
+        j = 0
+        for i in range(len(owners)):
+            movs = offsets[j:j+n_movs[i]]
+            if empty[i]:
+                tests[owners[i]] = None
+            else:
+                tests[owners[i]] = [(errs[j+m], movs[m]) for m in range(len(movs))]
+            j += len(movs)
+
+        return tests
+
     # Move vertices sequentially, sorted by approximation error starting with highest
     def move_vertices_seq(self, step=1, verbose=None):
         
         sorted_v = sorted(self.get_vertices(), key=lambda v: v.get_err())
         total_v = len(self.get_vertices())
         counter = 1
+        self.pending_tests = []
 
         for v in sorted_v:
 
@@ -269,9 +391,12 @@ class Mesh:
             v.update_mov_dir()
 
             if v.get_mov_dir() != (0,0):
+                self.replay_tests()
                 x,y = v.get_mov_dir()
                 v.move((x*step,y*step))
 
+        self.pending_tests = []
+
     ################
     #  REFINEMENT  #
     ################
@@ -347,7 +472,7 @@ class Mesh:
             coll_1 = False
             e = self.get_edges()[i]
 
-            if e.length() < self.get_min_e_len():
+            if e.length_squared() < self.get_min_e_len()**2:
                 coll_t_1 = e.edge_collapse()
                 if coll_t_1 > 0:
                     collapses += 1
@@ -465,6 +590,36 @@ class Mesh:
                 loop_list.append(loop)
 
         return loop_list
+
+    # Save paths in make_poly.py format
+    def format_paths(self, path_list):
+
+        new_path_list = []
+    
+        for path in path_list:
+            new_path = [e.get_end().to_tuple() for e in path]
+
+            min_y = min(new_path, key=lambda v: v[1])
+            i = new_path.index(min_y)
+        
+            prev = new_path[(i-1)%len(new_path)]
+            next = new_path[(i+1)%len(new_path)]
+
+            edge_1 = [min_y, next]
+            edge_2 = [prev, min_y]
+
+            cross = get_cross(edge_1[0], edge_1[1], edge_2[1], edge_2[0])
+
+            hole = None
+            if cross > 0:
+                hole = path[0].get_twin().get_triangle().centroid()
+            if cross == 0:
+                if prev[0] < min_y[0]:
+                    hole = path[0].get_twin().get_triangle().centroid()
+
+            new_path_list.append((new_path, hole))
+
+        return new_path_list
     
     # Check mesh integrity
     def health_check(self, verbose=False):
@@ -689,6 +844,61 @@ class Mesh:
             rand_v = random.randint(-v_range,v_range)
             v.move((rand_h,rand_v))
 
+    #####################
+    # DRAWING FUNCTIONS #
+    #####################
+
+    # Draw triangles with approximation error
+    def draw_triangles(self, img, color="avg"):
+        for t in self.triangles:
+            for y, x0, x1 in t.points.tolist():
+                if color == "avg":
+                    c = t.get_avg()
+                else:
+                    c = t.get_err()*2
+                cv2.line(img, (x0,y), (x1,y), [c,c,c], 1)
+
+        return img
+
+    # Draw mesh edges
+    def draw_edges(self, img, same=False):
+        for e in self.get_edges():
+            p1 = e.start_v.to_tuple()
+            p2= e.end_v.to_tuple()
+            if e.get_is_border():
+                if same:
+                    cv2.line(img, p1, p2, (0,255,0), 1)
+                else:
+                    cv2.line(img, p1, p2, (0,0,255), 2)
+            else:
+                can_draw = True
+                if e.get_twin():
+                    if e.get_twin().get_is_border():
+                        can_draw = False
+                if can_draw:
+                    cv2.line(img, p1, p2, (0,255,0), 1)
+
+        return img
+
+    # Draw mesh vertices
+    def draw_vertices(self, img, v_err=True):
+        for v in self.get_vertices():
+
+            col = (0,0,0)
+
+            if v_err:
+                c = v.get_err()*6
+                if c > 255:
+                    c = 255
+                col = (c,0,0)
+
+            cv2.circle(img, (v.x_pos, v.y_pos), 3, col, -1)
+
+        return img
+
+
+# Mesh classes by first letter of engine name
+MESH_ENGINES = {"o": Mesh, "a": ArrayMesh}
 
 # Image class, always associated to mesh
 class Image:
@@ -769,7 +979,13 @@ class Image:
 
         self.dims = self.bw.shape # Image dimensions
 
+        # Cumulative sums of every row, row_sums[y, x] is the sum of bw[y, :x]
+        self.row_sums = np.zeros((self.dims[0], self.dims[1]+1), dtype=np.int64)
+        self.row_sums[:,1:] = np.cumsum(self.bw, axis=1, dtype=np.int64)
+
         self.mesh = None # Associated mesh
+        self.workers = 1 # Processes for vertex movement errors
+        self.pool = None # Worker processes, while open
 
     ###############
     #   GETTERS   #
@@ -777,15 +993,40 @@ class Image:
 
     def get_mesh(self):
         return self.mesh
+
+    ###############
+    #   SETTERS   #
+    ###############
+
+    def set_workers(self, workers):
+        self.workers = workers
+
+    # Start worker processes for vertex movement if more than one worker is
+    # set, they are kept until the with block ends so every iteration uses them
+    @contextmanager
+    def open_pool(self):
+        if self.workers <= 1 or self.pool is not None:
+            yield self.pool
+            return
+
+        with StarPool(self, self.workers) as pool:
+            self.pool = pool
+            try:
+                yield pool
+            finally:
+                self.pool = None
     
     ###############
     # INITIALIZER #
     ###############
 
     # Create a new triangle mesh and associate it with image
-    def add_mesh(self, h_tri, v_tri, min_e_len, same=False):
+    # Engine "arrays" stores the mesh in arrays, for very large meshes
+    # Both engines have the same operations, Image doesn't check which one
+    # is used
+    def add_mesh(self, h_tri, v_tri, min_e_len, same=False, engine="objects"):
 
-        self.mesh = Mesh(self, min_e_len)
+        self.mesh = MESH_ENGINES[engine[0]](self, min_e_len)
 
         x = self.dims[1]
         y = self.dims[0]
@@ -807,7 +1048,7 @@ class Image:
         self.update_vertices()
 
     def move_vertices(self, step=1, verbose=None):
-        self.mesh.move_vertices(step, verbose)
+        self.mesh.move_vertices(step, verbose, self.pool)
 
     def move_vertices_seq(self, step=1, verbose=None):
         self.mesh.move_vertices_seq(step, verbose)
@@ -832,6 +1073,9 @@ class Image:
     
     def border_get(self):
         return self.mesh.border_get()
+
+    def format_paths(self, path_list):
+        return self.mesh.format_paths(path_list)
     
     def health_check(self, verbose=False):
         self.mesh.health_check(verbose)
@@ -842,54 +1086,20 @@ class Image:
 
     # Draw triangles with approximation error
     def draw_triangles(self, img, color="avg"):
-        if self.get_mesh():
-            for t in self.get_mesh().triangles:
-                for p in t.points:
-                    if color == "avg":
-                        c = t.get_avg()
-                    else:
-                        c = t.get_err()*2
-                    cv2.line(img, p[0], p[1], [c,c,c], 1)
-        
+        if self.mesh:
+            self.mesh.draw_triangles(img, color)
         return img
-    
+
     # Draw mesh edges
     def draw_edges(self, img, same=False):
         if self.mesh:
-            # Draw edges
-            for e in self.mesh.get_edges():
-                p1 = e.start_v.to_tuple()
-                p2= e.end_v.to_tuple()
-                if e.get_is_border():
-                    if same:
-                        cv2.line(img, p1, p2, (0,255,0), 1)
-                    else:
-                        cv2.line(img, p1, p2, (0,0,255), 2)
-                else:
-                    can_draw = True
-                    if e.get_twin():
-                        if e.get_twin().get_is_border():
-                            can_draw = False
-                    if can_draw:
-                        cv2.line(img, p1, p2, (0,255,0), 1)
-            
+            self.mesh.draw_edges(img, same)
         return img
 
     # Draw mesh vertices
     def draw_vertices(self, img, v_err=True):
         if self.mesh:
-            for v in self.mesh.get_vertices():
-
-                col = (0,0,0)
-
-                if v_err:
-                    c = v.get_err()*6
-                    if c > 255:
-                        c = 255
-                    col = (c,0,0)
-
-                cv2.circle(img, (v.x_pos, v.y_pos), 3, col, -1)
-        
+            self.mesh.draw_vertices(img, v_err)
         return img
 
     # Draw mesh
@@ -0,0 +1,80 @@
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from .triangle import *
+
+# Vertices sent to a worker at once
+STAR_CHUNK = 1024
+
+# Image row sums attached by each worker process
+worker_shm = None
+worker_row_sums = None
+
+# Attach image row sums in shared memory, in a worker process
+def attach_row_sums(name, shape):
+    global worker_shm, worker_row_sums
+    worker_shm = shared_memory.SharedMemory(name=name)
+    worker_row_sums = np.ndarray(shape, dtype=np.int64, buffer=worker_shm.buf)
+
+# Run star_errs on a chunk of stars, in a worker process
+def star_errs_chunk(payload):
+    return star_errs(*payload, worker_row_sums)
+
+# Pool of worker processes that calculate the error of vertex movements
+# The row sums of the image are shared, and every worker receives only the
+# triangle positions of a chunk of vertex stars
+class StarPool:
+    def __init__(self, image, workers):
+        row_sums = image.row_sums
+
+        self.shm = shared_memory.SharedMemory(create=True, size=max(row_sums.nbytes, 1))
+        self.executor = None
+
+        # Shared memory is removed if the workers can't be started
+        try:
+            shared = np.ndarray(row_sums.shape, dtype=np.int64, buffer=self.shm.buf)
+            shared[:] = row_sums
+            del shared
+
+            self.executor = ProcessPoolExecutor(max_workers=workers, initializer=attach_row_sums,
+                                                initargs=(self.shm.name, row_sums.shape))
+        except BaseException:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    # Stop worker processes and remove shared memory
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+    # Same as star_errs, with chunks of stars in the worker processes
+    def star_errs(self, tri, is_self, n_faces, offsets, n_movs):
+
+        face_ends = np.cumsum(n_faces)
+        mov_ends = np.cumsum(n_movs)
+
+        payloads = []
+        for i in range(0, len(n_faces), STAR_CHUNK):
+            j = min(i + STAR_CHUNK, len(n_faces))
+            f0, f1 = face_ends[i] - n_faces[i], face_ends[j-1]
+            m0, m1 = mov_ends[i] - n_movs[i], mov_ends[j-1]
+            payloads.append((tri[f0:f1], is_self[f0:f1], n_faces[i:j], offsets[m0:m1], n_movs[i:j]))
+
+        results = list(self.executor.map(star_errs_chunk, payloads))
+        if len(results) == 0:
+            return np.zeros(0), np.zeros(0, dtype=bool)
+
+        errs = np.concatenate([r[0] for r in results])
+        empty = np.concatenate([r[1] for r in results])
+        return errs, empty
@@ -1,14 +1,233 @@
 import numpy as np
+from geometry import *
+
+################
+# SPAN KERNELS #
+################
+
+# Line through points p and q, as in get_equations, for rows y
+# Vertical and horizontal lines take x from vertex, as in solve_equations
+def solve_lines(y, p, q, vertex):
+    vertical = p[:,0] == q[:,0]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        m = (p[:,1]-q[:,1])/np.where(vertical, 1, p[:,0]-q[:,0])
+        b = p[:,1] - m*p[:,0]
+        x = (y-b)//m
+
+    return np.where(vertical | (m == 0), vertex[:,0], x)
+
+# x coordinates of line through points p and q at rows ys, as in
+# get_equations and solve_equations
+def solve_line(ys, p, q, vertex):
+    if p[0] != q[0]:
+        m = (p[1]-q[1])/(p[0]-q[0])
+        if m:
+            b = p[1] - m*p[0]
+            return (ys-b)//m
+
+    return np.full(len(ys), vertex[0])
+
+# Spans of points contained in triangle, one row for every y from the highest
+# to the lowest vertex. Returns an int array of (y, x0, x1) rows
+# Same spans as scanline_spans, faster for a single triangle
+def triangle_spans(vertices):
+
+    # Sort vertices by y coordinate
+    v0, v1, v2 = sorted(vertices, key=lambda v: v[1])
+
+    # Case 1: Upper points at same heights, horizontal span at top
+    if v0[1] == v1[1]:
+        left, right = sorted((v0, v1), key=lambda v: v[0])
+
+        ys = np.arange(v0[1]+1, v2[1]+1)
+        x_l = solve_line(ys, left, v2, left)
+        x_r = solve_line(ys, right, v2, right)
+
+    # Case 2: Lower points at same heights, horizontal span at bottom
+    elif v1[1] == v2[1]:
+        left, right = sorted((v1, v2), key=lambda v: v[0])
+
+        ys = np.arange(v0[1], v1[1])
+        x_l = solve_line(ys, left, v0, left)
+        x_r = solve_line(ys, right, v0, right)
+
+    # Case 3: All points at different heights, split at middle vertex
+    else:
+        left, right = sorted((v1, v2), key=lambda v: v[0])
+
+        upper = np.arange(v0[1], v1[1])
+        lower = np.arange(v1[1], v2[1]+1)
+        ys = np.arange(v0[1], v2[1]+1)
+
+        # Lines below middle vertex use the base instead of one side
+        if v1 == left:
+            x_l = np.concatenate((solve_line(upper, left, v0, left), solve_line(lower, right, left, left)))
+            x_r = solve_line(ys, right, v0, right)
+        else:
+            x_l = solve_line(ys, left, v0, left)
+            x_r = np.concatenate((solve_line(upper, right, v0, right), solve_line(lower, right, left, right)))
+
+    spans = np.stack((ys, np.minimum(x_l, x_r), np.maximum(x_l, x_r)), axis=1).astype(np.int64)
+
+    # Horizontal edge is a span from left to right vertex
+    if v0[1] == v1[1]:
+        spans = np.concatenate(([(v0[1], left[0], right[0])], spans))
+    elif v1[1] == v2[1]:
+        spans = np.concatenate((spans, [(v1[1], left[0], right[0])]))
+
+    return spans
+
+# Spans of points contained in each triangle of a list, one row for every y
+# from the highest to the lowest vertex. Returns an int array of (y, x0, x1)
+# rows, spans of each triangle in order, and the number of rows of each one
+def scanline_spans(triangles):
+    tri = np.asarray(triangles, dtype=np.int64).reshape(-1,3,2)
+
+    # Sort vertices by y coordinate
+    order = np.argsort(tri[:,:,1], axis=1, kind="stable")
+    v0, v1, v2 = np.moveaxis(np.take_along_axis(tri, order[:,:,None], axis=1), 1, 0)
+
+    # Case 1: Upper points at same heights, horizontal span at top
+    # Case 2: Lower points at same heights, horizontal span at bottom
+    # Case 3: All points at different heights, split at middle vertex
+    case_1 = v0[:,1] == v1[:,1]
+    case_2 = ~case_1 & (v1[:,1] == v2[:,1])
+    case_3 = ~case_1 & ~case_2
+
+    # Pair of vertices sorted by x, top pair in case 1 and base in others
+    pair_a = np.where(case_1[:,None], v0, v1)
+    pair_b = np.where(case_1[:,None], v1, v2)
+    swap = (pair_b[:,0] < pair_a[:,0])[:,None]
+    left = np.where(swap, pair_b, pair_a)
+    right = np.where(swap, pair_a, pair_b)
+
+    # Vertex opposite to the pair
+    apex = np.where(case_1[:,None], v2, v0)
+
+    # Lines below middle vertex in case 3 use the base instead of one side
+    middle_left = case_3 & (left == v1).all(axis=1)
+    middle_right = case_3 & ~middle_left
+
+    counts = v2[:,1] - v0[:,1] + 1
+    tri_index = np.repeat(np.arange(len(tri)), counts)
+    starts = np.cumsum(counts) - counts
+    y = v0[tri_index,1] + np.arange(counts.sum()) - starts[tri_index]
+
+    left_r = left[tri_index]
+    right_r = right[tri_index]
+    apex_r = apex[tri_index]
+    lower = y >= v1[tri_index,1]
+
+    # Left line, from left to apex or from right to left
+    base_l = (middle_left[tri_index] & lower)[:,None]
+    x_l = solve_lines(y, np.where(base_l, right_r, left_r), np.where(base_l, left_r, apex_r), left_r)
+
+    # Right line, from right to apex or from right to left
+    base_r = (middle_right[tri_index] & lower)[:,None]
+    x_r = solve_lines(y, right_r, np.where(base_r, left_r, apex_r), right_r)
+
+    x0 = np.minimum(x_l, x_r)
+    x1 = np.maximum(x_l, x_r)
+
+    # Horizontal edge is a span from left to right vertex
+    flat = (case_1[tri_index] & (y == v0[tri_index,1])) | (case_2[tri_index] & (y == v2[tri_index,1]))
+    x0 = np.where(flat, left_r[:,0], x0)
+    x1 = np.where(flat, right_r[:,0], x1)
+
+    spans = np.stack((y, x0, x1), axis=1).astype(np.int64)
+
+    return spans, counts
+
+# Point count and color sum of every span, as slices bw[y, x0:x1]
+# row_sums are the cumulative sums of the image rows, from Image
+def span_sums(spans, row_sums):
+    y = spans[:,0]
+    width = row_sums.shape[1] - 1
+
+    # Negative limits count from the end of the row, as in slices
+    x0 = np.clip(np.where(spans[:,1] < 0, spans[:,1] + width, spans[:,1]), 0, width)
+    x1 = np.clip(np.where(spans[:,2] < 0, spans[:,2] + width, spans[:,2]), 0, width)
+
+    lengths = np.maximum(x1 - x0, 0)
+    sums = np.where(lengths > 0, row_sums[y, x1] - row_sums[y, x0], 0)
+
+    return lengths, sums
+
+# Average color of each triangle from scanline_spans output, as
+# Triangle.update_err. Returns averages and point counts, average is nan for
+# triangles with no points
+def spans_avg(spans, counts, row_sums):
+    lengths, sums = span_sums(spans, row_sums)
+
+    n = len(spans)
+    pos = np.arange(n)
+    starts = np.cumsum(counts) - counts
+    group = np.repeat(np.arange(len(counts)), counts)
+
+    # Spans before the first one with more than one point are discarded
+    first = np.minimum.reduceat(np.where(lengths > 1, pos, n), starts)
+    first = np.where(first < n, first, starts + counts - 1)
+    keep = pos >= first[group]
+
+    l = np.add.reduceat(np.where(keep, lengths, 0), starts)
+    total = np.add.reduceat(np.where(keep, sums, 0), starts)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        avg = total/l
+
+    return avg, l
+
+# Approximation error of each triangle from scanline_spans output, as
+# Triangle.update_err. Returns errors and point counts, error is nan for
+# triangles with no points
+def spans_err(spans, counts, row_sums):
+    avg, l = spans_avg(spans, counts, row_sums)
+    return np.where(avg > 127, 255 - avg, avg), l
+
+# Default movement errors of update_mov_dir, not calculated yet
+NOT_TESTED = object()
+
+# Approximation error of many vertex stars for every candidate direction,
+# as Vertex.test_mov_dirs. tri holds the triangles of all stars, is_self marks
+# the star vertex in them, n_faces and n_movs are the triangles and directions
+# of each star and offsets the directions of all stars
+# Returns summed error of every direction and mask of stars where a triangle
+# is left without points
+def star_errs(tri, is_self, n_faces, offsets, n_movs, row_sums):
+
+    # One row for every direction and triangle of each star
+    rows = n_faces*n_movs
+    owner = np.repeat(np.arange(len(n_faces)), rows)
+    local = np.arange(rows.sum()) - np.repeat(np.cumsum(rows) - rows, rows)
+    star_row = np.repeat(np.cumsum(n_faces) - n_faces, rows) + local % n_faces[owner]
+    cand = np.repeat(np.cumsum(n_movs) - n_movs, rows) + local // n_faces[owner]
+
+    moved = tri[star_row] + is_self[star_row][:,:,None]*offsets[cand][:,None,:]
+
+    if len(moved) > 0:
+        spans, counts = scanline_spans(moved)
+        t_err, l = spans_err(spans, counts, row_sums)
+    else:
+        t_err, l = np.zeros(0), np.zeros(0, dtype=np.int64)
+
+    empty = np.bincount(owner[l == 0], minlength=len(n_faces)) > 0
+
+    # Sums of whole numbers, same as in Vertex.update_err
+    errs = np.bincount(cand, weights=t_err//3, minlength=len(offsets))
+
+    return errs, empty
 
 # Triangle class
 class Triangle:
     def __init__(self, mesh, edge_list):
         self.mesh = mesh        # Associated mesh
         self.edges = edge_list  # List of 3 edges that define triangle
-        self.points = []        # List of points contained in triangle
+        self.points = np.zeros((0,3), dtype=np.int64) # Spans (y, x0, x1) of points contained in triangle
         self.avg = None         # Average color of triangle
         self.err = None         # Approximation error
         self.new = True         # New triangle flag, True in 1st iteration
+        self.dirty = True       # Dirty flag, True if points must be recalculated
 
     ###############
     #   GETTERS   #
@@ -44,6 +263,10 @@ class Triangle:
     def get_new(self):
         return self.new
 
+    # Check if a vertex moved since points were calculated
+    def get_dirty(self):
+        return self.dirty
+
     ###############
     #   SETTERS   #
     ###############
@@ -53,9 +276,15 @@ class Triangle:
 
     def set_not_new(self):
         self.new = False
+
+    def set_dirty(self):
+        self.dirty = True
     
+    # Vertices must sum the new error
     def set_err(self, app_error):
         self.err = app_error
+        for v in self.vertex_list():
+            v.set_dirty()
 
     def set_avg(self, avg):
         self.avg = avg
@@ -74,104 +303,10 @@ class Triangle:
     #   UPDATERS   #
     ################
     
-    # Updates list of points contained inside triangle        
+    # Updates spans of points contained inside triangle, as (y, x0, x1) rows
     def update_points(self):
-        
-        def get_equations(v1, v2):
-            if v1[0] != v2[0]:
-                m = (v1[1]-v2[1])/(v1[0]-v2[0])
-                b = v1[1] - m*v1[0]
-            else:
-                m = None
-                b = None
-            return (m,b)
-        
-        def solve_equations(y, m, b, vertex):
-            if not m:
-                return vertex[0]
-            
-            return (y-b)//m
- 
-        vertices = self.vertex_list_t()
-        
-        # Define the vertices of the triangle
-        lines = []
-
-        # Sort vertices by y coordinate:
-        y_sort = sorted(vertices, key=lambda v: v[1])
-
-        # Case 1: Upper points at same heights
-        if y_sort[0][1] == y_sort[1][1]:
-            lower = y_sort.pop(2)
-            top = sorted(y_sort, key=lambda v: v[0])
-            left = top[0]
-            right = top[1]
-
-            left_m, left_b = get_equations(left, lower)
-            right_m, right_b = get_equations(right, lower)
-
-            lines.append((left, right))
-
-            for y in range(left[1]+1,lower[1]+1):
-                x1 = solve_equations(y,left_m,left_b,left)
-                x2 = solve_equations(y,right_m,right_b,right)
-
-                start = min(x1,x2)
-                stop = max(x1,x2)
-
-                lines.append(((int(start),y),(int(stop),y)))
-        
-        # Case 2: Lower points at same heights
-        elif y_sort[1][1] == y_sort[2][1]:
-            upper = y_sort.pop(0)
-            base = sorted(y_sort, key=lambda v: v[0])
-            left = base[0]
-            right = base[1]
-
-            left_m, left_b = get_equations(left, upper)
-            right_m, right_b = get_equations(right, upper)
-
-            for y in range(upper[1],left[1]):
-                x1 = solve_equations(y,left_m,left_b,left)
-                x2 = solve_equations(y,right_m,right_b,right)
-
-                start = min(x1,x2)
-                stop = max(x1,x2)
-
-                lines.append(((int(start),y),(int(stop),y)))
-
-            lines.append((left, right))
-
-        # Case 3: All points at different heights
-        else:
-            middle = y_sort[1]
-            top = y_sort.pop(0)
-            base = sorted(y_sort, key=lambda v: v[0])
-            left = base[0]
-            right = base[1]
-
-            left_m, left_b = get_equations(left, top)
-            right_m, right_b = get_equations(right, top)
-            base_m, base_b = get_equations(right, left)
-
-            for y in range(top[1],max([v[1] for v in vertices])+1):
-                if y < middle[1]:
-                    x1 = solve_equations(y,left_m,left_b,left)
-                    x2 = solve_equations(y,right_m,right_b,right)
-                else:
-                    if middle == left:
-                        x1 = solve_equations(y,base_m,base_b,left)
-                        x2 = solve_equations(y,right_m,right_b,right)
-                    else:
-                        x1 = solve_equations(y,left_m,left_b,left)
-                        x2 = solve_equations(y,base_m,base_b,right)
-
-                start = min(x1,x2)
-                stop = max(x1,x2)
-                
-                lines.append(((int(start),y),(int(stop),y)))
-
-        self.set_points(lines)
+        self.set_points(triangle_spans(self.vertex_list_t()))
+        self.dirty = False
         return self.get_points()
 
 
@@ -182,19 +317,16 @@ class Triangle:
         if update_all or (len(self.points) <= 0):
             self.update_points()
         
-        color_arr = []
+        lengths, sums = span_sums(self.get_points(), self.mesh.image.row_sums)
 
-        for line in self.get_points():
+        # Colors of spans are concatenated from the first span with more than
+        # one point, previous spans are discarded. If there is none, only the
+        # last span is used
+        wide = np.flatnonzero(lengths > 1)
+        first = wide[0] if len(wide) > 0 else len(lengths)-1
 
-            color = self.mesh.image.bw[line[0][1] , line[0][0]:line[1][0]]
-
-            # Fill color_arr
-            if len(color_arr) > 1:
-                color_arr = np.concatenate((color_arr,color))
-            else:
-                color_arr = color
-                    
-        l = len(color_arr)
+        l = int(lengths[first:].sum())
+        total = int(sums[first:].sum())
         
         if l == 0:
             #print("WARNING: Empty points array")
@@ -207,7 +339,7 @@ class Triangle:
 
         # Approximation error is distance to 0 or 255
         else:
-            avg = np.mean(color_arr)
+            avg = np.float64(total)/l
             self.set_avg(avg)
             if avg > 127:
                 self.set_err(255 - avg)
@@ -335,9 +467,9 @@ class Triangle:
 
         edges = [self.mesh.make_edge(c,v,False) for v in vertices]
 
-        min_edge = min(edges, key=lambda e: e.length())
+        min_edge = min(edges, key=lambda e: e.length_squared())
 
-        if min_edge.length() > self.get_mesh().get_min_e_len():
+        if min_edge.length_squared() > self.get_mesh().get_min_e_len()**2:
             return self.insert_point()
 
         else:
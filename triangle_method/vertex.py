@@ -1,3 +1,6 @@
+import numpy as np
+from .triangle import *
+
 # Vertex class
 class Vertex:
 
@@ -11,6 +14,7 @@ class Vertex:
         self.movement = []      # Allowed movement directions for x and y axes
         self.mov_dir = None     # Direction of next movement
         self.broken = False
+        self.dirty = True       # Dirty flag, True if adjacent errors or edges changed
 
     ###############
     #   GETTERS   #
@@ -42,6 +46,10 @@ class Vertex:
     def get_broken(self):
         return self.broken
 
+    # Check if error must be summed again
+    def get_dirty(self):
+        return self.dirty
+
     ###############
     #   SETTERS   #
     ###############
@@ -56,14 +64,19 @@ class Vertex:
     def add_movement(self, dirs):
         self.movement += dirs
 
+    def set_dirty(self):
+        self.dirty = True
+
     # Adds new edge to edge list
     def add_edge(self, edge):
         self.edges.append(edge)
+        self.set_dirty()
 
     # Removes edge from edge list
     def remove_edge(self, edge):
         if edge in self.edges:
             self.edges.remove(edge)
+            self.set_dirty()
         else:
             print("ERROR: Can't remove edge not in vertex edge list")
             return
@@ -96,34 +109,45 @@ class Vertex:
             v_err += t.get_err()//3
         if update:
             self.set_err(v_err)
+            self.dirty = False
         return v_err
     
+    # Candidate movement directions, empty if vertex can't move
+    def candidate_movs(self):
+
+        # If movement not allowed or all surrounding triangles
+        # have approximation error 0, no candidates
+        if len(self.get_movement()) == 0 or self.get_err() == 0:
+            return []
+
+        # Try diagonal movement for vertices with high error
+        if self.get_err() > 50 and len(self.get_movement()) >= 4:
+            return self.get_movement() + [(1,1),(1,-1),(-1,1),(-1,-1)]
+
+        return self.get_movement()
+
     # Get next movement direction
-    def update_mov_dir(self):
+    # test_err is the result of test_mov_dirs, if already calculated
+    def update_mov_dir(self, test_err=NOT_TESTED):
 
-        # If movement not allowed, end
-        if len(self.get_movement()) == 0:
-            self.set_mov_dir((0,0))
-            return
-        
-        # If all surrounding triangles have approximation error 0, end
-        if self.get_err() == 0:
+        movs = self.candidate_movs()
+        if len(movs) == 0:
             self.set_mov_dir((0,0))
             return
-    
+
         # Get new error for each direction
         tri_list = self.adjacent_triangles()
-        test_err = []
+        if test_err is NOT_TESTED:
+            test_err = self.test_mov_dirs(movs, tri_list)
 
-        # Try diagonal movement for vertices with high error
-        new_mov = self.get_movement() + [(1,1),(1,-1),(-1,1),(-1,-1)]
-
-        if self.get_err() > 50 and len(self.get_movement()) >= 4:
-            for dir in range(len(new_mov)):
-                test_err.append(self.test_mov_dir(new_mov[dir],tri_list))
+        # Sequential test is only needed if a triangle is left without points,
+        # which collapses one of its edges. It reads the errors left in the
+        # triangles by the tests of previous vertices
+        if test_err is None:
+            self.mesh.replay_tests()
+            test_err = [self.test_mov_dir(mov, tri_list) for mov in movs]
         else:
-            for dir in range(len(self.get_movement())):
-                test_err.append(self.test_mov_dir(self.get_movement()[dir],tri_list))
+            self.mesh.pending_tests.append((self, movs[-1]))
 
         # Get minimum calculated approximation error
         min_g = min(test_err, key=lambda g: g[0])
@@ -157,6 +181,41 @@ class Vertex:
         self.move((-mov[0],-mov[1]))
 
         return (err, mov)
+
+    # Approximation error for every candidate direction, as test_mov_dir,
+    # computed for all directions and triangles at once without moving the
+    # vertex. Returns None if a triangle is left without points
+    def test_mov_dirs(self, movs, tri_list):
+
+        # Removed vertices have no triangles, error is 0 in every direction
+        if len(tri_list) == 0:
+            return [(0, mov) for mov in movs]
+
+        # Vertices of adjacent triangles for every direction
+        tri = np.array([t.vertex_list_t() for t in tri_list], dtype=np.int64)
+        is_self = np.array([[v is self for v in t.vertex_list()] for t in tri_list])
+
+        offsets = np.array(movs, dtype=np.int64)
+        moved = np.repeat(tri[None], len(movs), axis=0)
+        moved += is_self[None,:,:,None] * offsets[:,None,None,:]
+
+        spans, counts = scanline_spans(moved.reshape(-1,3,2))
+        t_err, l = spans_err(spans, counts, self.get_mesh().image.row_sums)
+
+        if (l == 0).any():
+            return None
+
+        # Same sum as update_err
+        v_err = (t_err//3).reshape(len(movs), len(tri_list))
+
+        test_err = []
+        for i in range(len(movs)):
+            err = 0
+            for g in v_err[i]:
+                err += g
+            test_err.append((err, movs[i]))
+
+        return test_err
     
     ###############
     #   REMOVER   #
@@ -169,11 +228,15 @@ class Vertex:
     # GEOMETRY FUNCTIONS #
     ######################
 
-    # Move vertex in a direction
+    # Move vertex in a direction, adjacent triangles must be updated
     def move(self,mov):
         self.x_pos += mov[0]
         self.y_pos += mov[1]
 
+        for e in self.edges:
+            if e.get_triangle():
+                e.get_triangle().set_dirty()
+
     # Get list of adjacent triangles
     def adjacent_triangles(self):
         tri_list = []
@@ -215,7 +278,7 @@ class Vertex:
 
     # Get longest adjacent edge
     def longest_edge(self):
-        return max(self.get_edges(), key=lambda e: e.length())
+        return max(self.get_edges(), key=lambda e: e.length_squared())
     
     # Get triangle with highest approximation error
     def highest_err_t(self):